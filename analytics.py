@@ -0,0 +1,102 @@
+# Derived analytics over the wide panel of all series
+# Every measure is computed for all series at once from the volume index, and
+# each one only looks a bounded number of months back (LOOKBACK) and ahead
+# (LOOKAHEAD). A new or revised month therefore only changes the tail of the
+# result, which is all update() recomputes
+
+import numpy as np
+import pandas as pd
+
+SEASONAL_YEARS = 5   # Years of the same calendar month averaged into a seasonal factor
+ZSCORE_MONTHS = 60   # Months of YoY history a z-score is measured against
+CORRELATION_MONTHS = 60
+
+# The trend is centred, so a figure changes the trend 6 months before it; the
+# oldest input is the volume behind the first YoY in the z-score window
+LOOKAHEAD = 6
+LOOKBACK = ZSCORE_MONTHS + 12
+
+# Define a function to compute every measure from a regular monthly volume panel
+# (one column per series); returns a frame with (measure, series) columns
+def compute(volume):
+    volume = volume.astype('float64')
+    yoy = volume.pct_change(12, fill_method=None) * 100
+
+    # Centred 2x12 moving average, as in classical decomposition
+    trend = volume.rolling(12).mean().rolling(2).mean().shift(-LOOKAHEAD)
+
+    # Seasonal factor: mean ratio to trend in the same month of earlier years,
+    # so the latest months, which have no centred trend yet, still get one
+    ratio = (volume / trend).to_numpy()
+    total = np.zeros_like(ratio)
+    count = np.zeros_like(ratio)
+    for years in range(1, SEASONAL_YEARS + 1):
+        lag = 12 * years
+        if lag >= len(ratio):
+            break
+        earlier = ratio[:-lag]
+        valid = np.isfinite(earlier)
+        total[lag:] += np.where(valid, earlier, 0)
+        count[lag:] += valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        seasonal = pd.DataFrame(total / count, index=volume.index, columns=volume.columns)
+
+    mean = yoy.rolling(ZSCORE_MONTHS, min_periods=24).mean()
+    std = yoy.rolling(ZSCORE_MONTHS, min_periods=24).std()
+    return pd.concat({
+        'volume': volume,
+        'ma3': volume.rolling(3).mean(),
+        'ma12': volume.rolling(12).mean(),
+        'mom': volume.pct_change(1, fill_method=None) * 100,
+        'yoy': yoy,
+        'trend': trend,
+        'seasonal': seasonal,
+        'adjusted': volume / seasonal,
+        'zscore': (yoy - mean) / std
+    }, axis=1, names=['measure', 'series'])
+
+# Define a function to bring a previous result up to date with a volume panel
+# Only rows from LOOKAHEAD months before the first new or revised figure are
+# recomputed, from LOOKBACK months of history before them; returns the result
+# and the first period that changed, or None if nothing did
+def update(previous, volume):
+    if (previous is None or len(volume) == 0 or len(previous) == 0
+            or list(previous['volume'].columns) != list(volume.columns)
+            or previous.index[0] != volume.index[0] or len(previous) > len(volume)):
+        result = compute(volume)
+        return result, (result.index[0] if len(result) else None)
+
+    old = previous['volume'].reindex(volume.index).to_numpy()
+    new = volume.to_numpy(dtype='float64')
+    changed = np.flatnonzero(((old != new) & ~(np.isnan(old) & np.isnan(new))).any(axis=1))
+    if len(changed) == 0:
+        return previous, None
+
+    first = max(0, int(changed[0]) - LOOKAHEAD)
+    start = max(0, first - LOOKBACK)
+    tail = compute(volume.iloc[start:]).iloc[first - start:]
+    result = pd.concat([previous.iloc[:first], tail])
+    return result, result.index[first]
+
+# Define a function to rank series on their latest month
+# Series are ranked on YoY; each gets the figures of its own latest period
+def ranking_table(result):
+    rows = {}
+    for series in result['volume'].columns:
+        latest = result['volume'][series].last_valid_index()
+        if latest is None:
+            continue
+        rows[series] = {'period': latest, **{
+            measure: result[(measure, series)].loc[latest]
+            for measure in ('volume', 'mom', 'yoy', 'ma3', 'adjusted', 'zscore')
+        }}
+    table = pd.DataFrame.from_dict(rows, orient='index')
+    if len(table):
+        table.insert(0, 'rank', table['yoy'].rank(ascending=False, method='min').astype('Int64'))
+        table = table.sort_values('rank')
+    table.index.name = 'series'
+    return table
+
+# Define a function to correlate the month-on-month changes of all series
+def correlation_table(result, months=CORRELATION_MONTHS):
+    return result['mom'].iloc[-months:].corr()
@@ -0,0 +1,20 @@
+# Period helpers shared by the parser, the store, the query engine and snapshots
+# The API gives periods as YYYYMM (monthly) or YYYY (yearly) numbers; they are
+# turned into month- or year-start indexes by integer arithmetic, without
+# parsing strings. Only numpy and pandas are imported, so snapshot readers in
+# notebooks do not pull in the fetch code
+
+import numpy as np
+import pandas as pd
+
+# Define the dtype of period indexes, matching what pandas gives parsed periods
+PERIOD_DTYPE = pd.to_datetime(['197901'], format='%Y%m').dtype
+
+# Define a function to turn API period numbers into a month- or year-start index
+def period_index(periods, freq):
+    periods = np.asarray(periods, dtype=np.int64)
+    if freq == 'M':
+        values = ((periods // 100 - 1970) * 12 + periods % 100 - 1).astype('datetime64[M]')
+    else:
+        values = (periods - 1970).astype('datetime64[Y]')
+    return pd.DatetimeIndex(values.astype(PERIOD_DTYPE), name='period')
@@ -0,0 +1,84 @@
+# Micro-benchmark for parsing post.php responses
+# Compares the original string-filter parse with parse_dataset on a saved
+# (or synthetic) response, so the speedup can be measured offline
+#
+# Usage:
+#   python benchmarks/bench_parse.py                 # synthetic or saved sample
+#   python benchmarks/bench_parse.py --record        # save a live response first
+#   python benchmarks/bench_parse.py --response path/to/response.json
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import sample_data
+from initial_v2 import all_series, build_query, parse_dataset
+import fetch_engine
+
+# Define the original fetch_data parse, kept here as the baseline
+def legacy_parse(dataset, series):
+    df = pd.DataFrame(dataset)
+    df = df[~df['freq'].str.contains('Y')]
+    df = df[~df['OUTLET_TYPEDesc'].str.contains('Total')]
+    df = df[df['svDesc'].str.contains('Index')]
+    df = df.drop(['sv', 'sd_value'], axis=1)
+    data_df = df[['period', 'figure']].copy()
+    data_df.loc[:, 'period'] = pd.to_datetime(data_df['period'], format='%Y%m').dt.strftime('%Y-%m-%d')
+    data_df = data_df.sort_values(by='period')
+    data_df = data_df.rename(columns={'figure': f'{series}_volume_index'})
+    data_df[f'{series}_volume_index_yoy'] = data_df[f'{series}_volume_index'].pct_change(12) * 100
+    data_df['period'] = pd.to_datetime(data_df['period'])
+    data_df.set_index('period', inplace=True)
+    return data_df
+
+# Define a function to time a callable and return the best per-call time in milliseconds
+def best_ms(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark post.php response parsing")
+    parser.add_argument("--response", default=sample_data.SAMPLE_RESPONSE,
+                        help="Saved post.php response covering all series")
+    parser.add_argument("--record", action="store_true",
+                        help="Fetch a live response for all series and save it first")
+    parser.add_argument("--number", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.record:
+        sample_data.save_response(fetch_engine.post_query(build_query(all_series)), args.response)
+    response_data = sample_data.load_response(args.response)
+    dataset = response_data['dataSet']
+
+    # Single-series responses, as fetch_data receives them
+    per_series = {
+        series: [row for row in dataset if row['OUTLET_TYPE'] == series]
+        for series in all_series
+    }
+
+    # Both parses must produce the same frames before their timings mean anything
+    parsed = parse_dataset(dataset, all_series)
+    for series in all_series:
+        pd.testing.assert_frame_equal(parsed[series], legacy_parse(per_series[series], series),
+                                      check_dtype=False)
+
+    results = {
+        "legacy, per series x24": best_ms(
+            lambda: [legacy_parse(per_series[s], s) for s in all_series], args.number, args.repeat),
+        "parse_dataset, per series x24": best_ms(
+            lambda: [parse_dataset(per_series[s], [s]) for s in all_series], args.number, args.repeat),
+        "parse_dataset, bulk response": best_ms(
+            lambda: parse_dataset(dataset, all_series), args.number, args.repeat),
+    }
+    print(f"{len(dataset)} rows, {len(all_series)} series")
+    baseline = results["legacy, per series x24"]
+    for name, ms in results.items():
+        print(f"{name:32s} {ms:9.2f} ms  {baseline / ms:6.1f}x")
+
+if __name__ == "__main__":
+    main()
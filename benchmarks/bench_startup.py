@@ -0,0 +1,202 @@
+# Startup benchmark for initial.py and initial_v2.py
+# Runs every view in a fresh Python process against the local mock API and a
+# store filled beforehand, and reports the time to first paint (the page
+# title), to the first static chart and to a complete page, for the cold first
+# run of the process and for a rerun, plus the time to import each script's
+# modules. The all_static view is also run against an empty store, where its
+# charts load progressively while some series are slowed down, and against an
+# empty store with every API request failing, where it must still draw the page
+#
+# Usage:
+#   python benchmarks/bench_startup.py --output startup.json
+#   python benchmarks/bench_startup.py --repeat 5 --views individual all_interactive
+#   python benchmarks/bench_startup.py --slow 40=3 2=2
+
+import time
+
+START = time.perf_counter()  # Child processes measure from here
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+# Define the views, as the session state set before the first run
+VIEWS = {
+    "individual": {"view_type": "Select Individual Category"},
+    "all_static": {"view_type": "View All Categories", "render_mode": "🖼️ Static Images"},
+    "all_interactive": {"view_type": "View All Categories", "render_mode": "🖱️ Interactive"},
+    "analytics": {"view_type": "Analytics"}
+}
+
+# Define a function to time importing a script's modules, run in a child process
+def child_import(script):
+    sys.path.insert(0, ROOT)
+    __import__(os.path.splitext(script)[0])
+    return {"import": time.perf_counter() - START}
+
+# Define a function to run a script's body the way Streamlit's server does on
+# every rerun, as __main__ and from bytecode compiled on the first run
+_compiled = {}
+def run_script(path):
+    code = _compiled.get(path)
+    if code is None:
+        with open(path) as f:
+            code = _compiled[path] = compile(f.read(), path, 'exec')
+    exec(code, {'__name__': '__main__', '__file__': path})
+
+# Define a function to time a cold run and a rerun of one view, run in a child process
+def child_run(script, state):
+    import streamlit as st
+    from streamlit.delta_generator import DeltaGenerator
+    from streamlit.testing.v1 import AppTest
+
+    # The title is the first element every view draws; static charts are images
+    paints = []
+    images = []
+    title = st.title
+    image = DeltaGenerator.image
+
+    def timed_title(*args, **kwargs):
+        paints.append(time.perf_counter())
+        return title(*args, **kwargs)
+
+    def timed_image(*args, **kwargs):
+        images.append(time.perf_counter())
+        return image(*args, **kwargs)
+
+    st.title = timed_title
+    DeltaGenerator.image = timed_image
+    # AppTest compiles the script again on every run, which Streamlit's server
+    # caches, so the script is run from bytecode compiled once, like the server does
+    sys.path.insert(0, ROOT)
+    at = AppTest.from_string(
+        f"import bench_startup\nbench_startup.run_script({os.path.join(ROOT, script)!r})\n",
+        default_timeout=600
+    )
+    for key, value in state.items():
+        at.session_state[key] = value
+    result = {}
+    for run in ("cold", "rerun"):
+        paints.clear()
+        images.clear()
+        began = START if run == "cold" else time.perf_counter()
+        at.run()
+        finished = time.perf_counter()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        result[f"{run}_first_paint"] = paints[0] - began
+        if images:
+            result[f"{run}_first_chart"] = images[0] - began
+        result[f"{run}_complete"] = finished - began
+    return result
+
+# Define a function to run one measurement in a fresh interpreter
+def spawn(args, env):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"] + args,
+        env=env, capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"Child run {args} failed:\n{out.stderr[-3000:]}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+# Define a function to collect repeated measurements into summary rows
+def summarize(name, script, view, runs):
+    row = {"name": name, "script": script, "view": view}
+    for key in runs[0]:
+        seconds = [run[key] for run in runs]
+        row[key] = {"seconds": seconds, "min": min(seconds), "median": statistics.median(seconds)}
+    return row
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        mode, script = sys.argv[2], sys.argv[3]
+        result = child_import(script) if mode == "import" else child_run(script, json.loads(sys.argv[4]))
+        print(json.dumps(result))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark dashboard startup against a local mock API")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes per measurement")
+    parser.add_argument("--views", nargs="+", choices=list(VIEWS), default=list(VIEWS),
+                        help="Views of initial_v2.py to measure")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock API latency in seconds")
+    parser.add_argument("--slow", nargs="+", default=["40=3"], metavar="CODE=SECONDS",
+                        help="Extra mock API seconds for these series")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import mock_api
+    slow = {code: float(seconds) for code, seconds in (item.split("=", 1) for item in args.slow)}
+    server = mock_api.start_server(latency=args.latency, slow=slow)
+    failing = mock_api.start_server(latency=args.latency, failure_rate=1.0)
+
+    # Keep the store and prebuilt charts of this run away from the real ones
+    work_dir = tempfile.mkdtemp(prefix="hk-retail-startup-")
+    env = dict(
+        os.environ,
+        HK_RETAIL_API_URL=server.url,
+        HK_RETAIL_STORE=os.path.join(work_dir, "store", "series.sqlite"),
+        HK_RETAIL_EXPORT_DIR=os.path.join(work_dir, "build"),
+        PYTHONPATH=os.pathsep.join([ROOT, BENCH_DIR, os.environ.get("PYTHONPATH", "")])
+    )
+
+    # Fill the store first, so cold runs measure startup rather than downloads
+    spawn(["run", "initial_v2.py", json.dumps(VIEWS["all_interactive"])], env)
+
+    # Each case is (mode, script, view, variant); a variant starts from an empty
+    # store, and "api_down" also points the app at a mock API failing every request
+    cases = [("import", "initial.py", None, None), ("import", "initial_v2.py", None, None),
+             ("run", "initial.py", "individual", None)]
+    cases += [("run", "initial_v2.py", view, None) for view in args.views]
+    if "all_static" in args.views:
+        cases.append(("run", "initial_v2.py", "all_static", "empty_store"))
+        cases.append(("run", "initial_v2.py", "all_static", "api_down"))
+
+    results = []
+    for mode, script, view, variant in cases:
+        child_args = [mode, script] + ([json.dumps(VIEWS[view])] if view else [])
+        runs = []
+        for i in range(args.repeat):
+            run_env = env
+            if variant is not None:
+                run_env = dict(env, HK_RETAIL_STORE=os.path.join(work_dir, f"{variant}-{i}", "series.sqlite"))
+            if variant == "api_down":
+                run_env["HK_RETAIL_API_URL"] = failing.url
+            runs.append(spawn(child_args, run_env))
+        name = "import" if mode == "import" else f"startup_{view}" + (f"_{variant}" if variant else "")
+        row = summarize(name, script, view, runs)
+        results.append(row)
+        timings = "  ".join(f"{key} {value['median'] * 1000:8.1f} ms"
+                            for key, value in row.items() if isinstance(value, dict))
+        print(f"{script:14s} {name:30s} {timings}", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "mock_api": {"latency": args.latency, "slow": slow},
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    server.shutdown()
+    failing.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+# Offline benchmark suite for initial.py and initial_v2.py
+# Starts the local mock API, then times cold and warm fetches, parsing, the
+# YoY computation, full and incremental analytics, the interactive page,
+# writing and loading the columnar snapshot and full all-categories rendering
+# for both y-axis modes, and writes the results as JSON so runs can be compared.
+# Before timing anything it checks that the incremental paths and the query
+# engine give the same results as full parses, with the requests expected, and
+# that loader processes sharing the store share their requests
+#
+# Usage:
+#   python benchmarks/bench_suite.py --output bench.json
+#   python benchmarks/bench_suite.py --latency 0.3 --failure-rate 0.1 --skip-render
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the store and prebuilt charts of this run away from the real ones
+WORK_DIR = tempfile.mkdtemp(prefix="hk-retail-bench-")
+os.environ["HK_RETAIL_STORE"] = os.path.join(WORK_DIR, "store", "series.sqlite")
+os.environ["HK_RETAIL_EXPORT_DIR"] = os.path.join(WORK_DIR, "build")
+
+import pandas as pd
+import streamlit as st
+
+import analytics
+import fetch_engine
+import initial
+import initial_v2
+import mock_api
+import query_engine
+import sample_data
+import series_store
+import snapshot
+
+# Define a function to forget every cached result, in memory and on disk
+def reset_caches():
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    series_store.STORE_PATH = os.path.join(WORK_DIR, "store", f"series-{time.time_ns()}.sqlite")
+
+# Define a function to time a callable; setup runs untimed before every repeat
+def measure(func, repeat, setup=None):
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+# Define a function to check analytics.update against a full compute, for
+# months appended to the panel and for revisions 30 and 100 months back
+def check_analytics(volume):
+    revisions = {}
+    for months_back in (30, 100):
+        revised = volume.copy()
+        revised.iloc[-months_back] = revised.iloc[-months_back] * 1.01
+        revisions[f"revision {months_back} months back"] = (volume, revised, len(volume) - months_back)
+    cases = {"appended months": (volume.iloc[:-3], volume, len(volume) - 3), **revisions}
+    for name, (before, after, changed) in cases.items():
+        result, since = analytics.update(analytics.compute(before), after)
+        pd.testing.assert_frame_equal(result, analytics.compute(after), obj=name)
+        assert since == after.index[changed - analytics.LOOKAHEAD], name
+
+# Define a function to check merge_delta against parsing the whole response
+# again, for months appended to stored series and for revisions 30 and 100
+# months back; each case is (stored before, fetched from, revised period)
+def check_merge_delta(dataset):
+    periods = sorted({row['period'] for row in dataset})
+    cases = {"appended months": (periods[-3], periods[-3 - initial_v2.OVERLAP_MONTHS], None)}
+    for months_back in (30, 100):
+        cases[f"revision {months_back} months back"] = (None, periods[-months_back], periods[-months_back])
+    for name, (stored_before, fetched_from, revised_period) in cases.items():
+        revised = [
+            dict(row, figure=row['figure'] * 1.01)
+            if row['period'] == revised_period and isinstance(row['figure'], (int, float)) else row
+            for row in dataset
+        ]
+        stored = initial_v2.parse_dataset(
+            [row for row in dataset if stored_before is None or row['period'] < stored_before],
+            initial_v2.all_series)
+        fetched = initial_v2.parse_dataset(
+            [row for row in revised if row['period'] >= fetched_from], initial_v2.all_series)
+        full = initial_v2.parse_dataset(revised, initial_v2.all_series)
+        for series in initial_v2.all_series:
+            merged, _ = initial_v2.merge_delta(series, stored[series], fetched[series][f'{series}_volume_index'])
+            pd.testing.assert_frame_equal(merged, full[series], check_freq=False,
+                                          obj=f"{name}, series {series}")
+
+# Define a function to check the query engine against parse_dataset, and that
+# it only asks the mock API for what it has not memoized: a first query costs
+# one request, an overlapping one one more, a contained one none, and five
+# concurrent copies of a query one between them
+def check_query_engine(server):
+    codes = initial_v2.all_series
+    reference = initial_v2.parse_dataset(
+        fetch_engine.post_query(initial_v2.build_query(codes))['dataSet'], codes)
+    cases = [
+        ("first", codes[:12], "197901", "200012", 1),
+        ("overlapping", codes[6:18], "199001", "201012", 1),
+        ("contained", codes[2:8], "199501", "200012", 0),
+    ]
+    query_engine.clear()
+    for name, series_list, start, end, requests in cases:
+        before = server.requests
+        frame = initial_v2.fetch_query(initial_v2.TABLE_ID, {"OUTLET_TYPE": series_list},
+                                       {initial_v2.SV_CODE: ["Raw_1dp_idx_n"]}, start, end)
+        assert server.requests - before == requests, (name, server.requests - before)
+        check_query_frame(frame, reference, series_list, start, end, name)
+
+    query_engine.clear()
+    frames = []
+    barrier = threading.Barrier(5)
+    def run():
+        barrier.wait()
+        frames.append(initial_v2.fetch_query(initial_v2.TABLE_ID, {"OUTLET_TYPE": codes},
+                                             {initial_v2.SV_CODE: ["Raw_1dp_idx_n"]}))
+    threads = [threading.Thread(target=run) for _ in range(5)]
+    before = server.requests
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.requests - before == 1, ("concurrent", server.requests - before)
+    assert len(frames) == 5, "concurrent"
+    for frame in frames:
+        check_query_frame(frame, reference, codes, initial_v2.HISTORY_START, None, "concurrent")
+    query_engine.clear()
+
+# Define a function to compare the columns of a query frame with parsed series
+def check_query_frame(frame, reference, series_list, start, end, name):
+    assert len(frame.columns) == len(series_list), name
+    for series in series_list:
+        expected = reference[series][f'{series}_volume_index'].loc[
+            pd.Timestamp(start + '01'):None if end is None else pd.Timestamp(end + '01')]
+        column = frame[(initial_v2.SV_CODE, "Raw_1dp_idx_n", series)]
+        pd.testing.assert_series_equal(column.dropna(), expected.dropna(), check_names=False,
+                                       check_freq=False, obj=f"{name}, series {series}")
+
+# Define a function for one loader process of check_single_flight: it loads
+# every series through the store's leases once the barrier lets it go
+def shared_loader(store, url, seconds, barrier, results):
+    series_store.STORE_PATH = store
+    fetch_engine.API_URL = url
+    fetch_engine.BACKOFF_BASE = 0.01
+    if barrier is not None:
+        barrier.wait()
+    all_data, missing = initial_v2.download_shared(initial_v2.all_series, fetch_engine.make_deadline(seconds))
+    results.put((len(all_data), len(missing)))
+
+# Define a function to check the store's leases across processes: loaders
+# starting together on an empty store make one request between them, and when
+# the leader fails its followers still load every series themselves
+def check_single_flight(server, failing, loaders=4):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    count = len(initial_v2.all_series)
+
+    store = os.path.join(WORK_DIR, "store", f"single-flight-cold-{time.time_ns()}.sqlite")
+    barrier = context.Barrier(loaders)
+    processes = [context.Process(target=shared_loader, args=(store, server.url, 60, barrier, results))
+                 for _ in range(loaders)]
+    before = server.requests
+    for process in processes:
+        process.start()
+    loaded = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join()
+    assert loaded == [(count, 0)] * loaders, ("cold loaders", loaded)
+    assert server.requests - before == 1, ("cold loaders", server.requests - before)
+
+    # The followers wait at the barrier until the leader has taken the leases
+    # and asked the failing API, which it keeps doing for a few seconds
+    store = os.path.join(WORK_DIR, "store", f"single-flight-failing-{time.time_ns()}.sqlite")
+    followers = loaders - 1
+    barrier = context.Barrier(followers + 1)
+    processes = [context.Process(target=shared_loader, args=(store, server.url, 60, barrier, results))
+                 for _ in range(followers)]
+    for process in processes:
+        process.start()
+    leader = context.Process(target=shared_loader, args=(store, failing.url, 5, None, results))
+    leader.start()
+    while not failing.requests:
+        time.sleep(0.05)
+    before = server.requests
+    barrier.wait()
+    loaded = sorted(results.get(timeout=120) for _ in range(loaders))
+    for process in processes + [leader]:
+        process.join()
+    assert loaded == [(0, count)] + [(count, 0)] * followers, ("failing leader", loaded)
+    assert 1 <= server.requests - before <= followers, ("failing leader", server.requests - before)
+
+# Define a function to render the all-categories view through Streamlit's test runner
+def run_dashboard(module, y_axis_type):
+    from streamlit.testing.v1 import AppTest
+    # Render workers re-import the running script, so it needs a main guard
+    if module is initial_v2:
+        call = f"initial_v2.plot_definitions({y_axis_type!r})"
+    else:
+        call = "initial.plot_definitions()"
+    script = f"import initial, initial_v2\nif __name__ == '__main__':\n    {call}\n"
+    at = AppTest.from_string(script, default_timeout=600)
+    at.session_state["charts_shown"] = len(initial_v2.all_series)  # Render every chart
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard against a local mock API")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeats for fetch and compute benchmarks")
+    parser.add_argument("--render-repeat", type=int, default=1, help="Repeats for rendering benchmarks")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random mock API latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of mock requests that fail")
+    parser.add_argument("--replay", help="Recorded post.php response for the mock API to serve")
+    parser.add_argument("--skip-render", action="store_true", help="Skip the rendering benchmarks")
+    args = parser.parse_args()
+
+    server = mock_api.start_server(latency=args.latency, jitter=args.jitter,
+                                   failure_rate=args.failure_rate, replay=args.replay)
+    fetch_engine.API_URL = server.url
+    fetch_engine.BACKOFF_BASE = 0.01  # Injected failures should not dominate timings
+
+    # Checks count requests, so they get a mock API of their own without failures
+    checks_server = mock_api.start_server(latency=args.latency, replay=args.replay)
+    failing_server = mock_api.start_server(latency=args.latency, failure_rate=1.0)
+    fetch_engine.API_URL = checks_server.url
+    check_query_engine(checks_server)
+    check_single_flight(checks_server, failing_server)
+    checks_server.shutdown()
+    failing_server.shutdown()
+    fetch_engine.API_URL = server.url
+
+    series = initial_v2.all_series[0]
+    dataset = sample_data.load_response(args.replay or sample_data.SAMPLE_RESPONSE)['dataSet']
+    all_data = initial_v2.parse_dataset(dataset, initial_v2.all_series)
+    panel = initial_v2.build_panel(all_data)
+    snapshot_dir = os.path.join(WORK_DIR, "snapshots")
+    snapshot.write(initial_v2.panel_snapshot(panel, initial_v2.panel_version(panel)), snapshot_dir)
+    volume = panel[initial_v2.VOLUME]
+    previous = analytics.compute(volume.iloc[:-1])
+
+    # Incremental results must match full ones before their timings mean anything
+    check_merge_delta(dataset)
+    check_analytics(volume)
+
+    # Each entry is (name, script, callable, setup, repeats); a setup of
+    # reset_caches makes the run cold, None leaves earlier results cached
+    cases = []
+    for module in (initial, initial_v2):
+        name = os.path.basename(module.__file__)
+        cases += [
+            ("fetch_data_cold", name, lambda m=module: m.fetch_data(series), reset_caches, args.repeat),
+            ("fetch_data_warm", name, lambda m=module: m.fetch_data(series), None, args.repeat),
+            ("fetch_all_data_cold", name, module.fetch_all_data, reset_caches, args.repeat),
+            ("fetch_all_data_warm", name, module.fetch_all_data, None, args.repeat),
+        ]
+    cases += [
+        ("parse", "initial_v2.py",
+         lambda: initial_v2.parse_dataset(dataset, initial_v2.all_series), None, args.repeat),
+        ("yoy_panel", "initial_v2.py", lambda: initial_v2.build_panel(all_data), None, args.repeat),
+        ("analytics_compute", "initial_v2.py", lambda: analytics.compute(volume), None, args.repeat),
+        ("analytics_update", "initial_v2.py",
+         lambda: analytics.update(previous, volume), None, args.repeat),
+        ("interactive_page_cold", "initial_v2.py",
+         lambda: initial_v2.interactive_page(panel, initial_v2.panel_version(panel)), reset_caches, args.repeat),
+        ("snapshot_write", "initial_v2.py",
+         lambda: snapshot.write(initial_v2.panel_snapshot(panel, initial_v2.panel_version(panel)),
+                                tempfile.mkdtemp(dir=WORK_DIR)), None, args.repeat),
+        ("snapshot_load", "initial_v2.py",
+         lambda: snapshot.to_panel(*snapshot.load(snapshot_dir)), None, args.repeat),
+    ]
+    if not args.skip_render:
+        cases += [
+            ("plot_definitions_cold", "initial.py",
+             lambda: run_dashboard(initial, None), reset_caches, args.render_repeat),
+        ]
+        for y_axis_type in ("Individual Y-Axis", "Common Y-Axis"):
+            mode = initial_v2.Y_AXIS_MODES[y_axis_type]
+            cases += [
+                (f"plot_definitions_{mode}_cold", "initial_v2.py",
+                 lambda y=y_axis_type: run_dashboard(initial_v2, y), reset_caches, args.render_repeat),
+                (f"plot_definitions_{mode}_warm", "initial_v2.py",
+                 lambda y=y_axis_type: run_dashboard(initial_v2, y), None, args.render_repeat),
+            ]
+
+    results = []
+    for name, script, func, setup, repeat in cases:
+        requests_before = server.requests
+        seconds = measure(func, repeat, setup)
+        results.append({
+            "name": name,
+            "script": script,
+            "seconds": seconds,
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "requests": server.requests - requests_before
+        })
+        print(f"{script:14s} {name:32s} {min(seconds) * 1000:10.1f} ms", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "mock_api": {"latency": args.latency, "jitter": args.jitter, "failure_rate": args.failure_rate,
+                     "replay": args.replay},
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
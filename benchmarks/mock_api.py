@@ -0,0 +1,121 @@
+# Local stand-in for the censtatd post.php API
+# Answers the same form-encoded queries with synthetic or replayed dataSet rows,
+# with injectable latency and failures, so fetch code can be measured offline
+#
+# Usage:
+#   python benchmarks/mock_api.py --port 8765 --latency 0.3 --failure-rate 0.1
+#   python benchmarks/mock_api.py --latency 0.3 --slow 40=5
+#   HK_RETAIL_API_URL=http://127.0.0.1:8765/api/post.php streamlit run initial_v2.py
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sample_data
+
+# Define a function to answer one query from the full set of rows
+# Keeps the requested OUTLET_TYPE codes and sv measures and the periods
+# between the requested start and end
+def answer_query(rows, query):
+    codes = set(query['cv']['OUTLET_TYPE'])
+    measures = set(query.get('sv', {})) or None
+    start = query.get('period', {}).get('start', '')
+    end = query.get('period', {}).get('end')
+    return {
+        "header": {"id": query.get('id'), "mock": True},
+        "dataSet": [
+            row for row in rows
+            if row['OUTLET_TYPE'] in codes
+            and (measures is None or row['sv'] in measures)
+            and row['period'][:len(start)] >= start[:len(row['period'])]
+            and (end is None or row['period'][:len(end)] <= end[:len(row['period'])])
+        ]
+    }
+
+# Define the request handler; behaviour is configured on the server instance
+class MockHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        try:
+            query = json.loads(parse_qs(body)['query'][0])
+            codes = query['cv']['OUTLET_TYPE']
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        with server.lock:
+            server.requests += 1
+            fail = server.rnd.random() < server.failure_rate
+            delay = server.latency + server.rnd.uniform(0, server.jitter)
+        # A request is as slow as the slowest series it asks for
+        delay += max((server.slow.get(code, 0.0) for code in codes), default=0.0)
+        time.sleep(delay)
+        if fail:
+            self.send_error(503, "Injected failure")
+            return
+        try:
+            payload = json.dumps(answer_query(server.rows, query)).encode()
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+# Define a function to start a mock server in a background thread
+# Rows come from a replayed response if given, otherwise they are synthesized;
+# slow maps OUTLET_TYPE codes to extra seconds for any request asking for them
+def start_server(port=0, latency=0.0, jitter=0.0, failure_rate=0.0, replay=None, seed=0, slow=None):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    if replay:
+        server.rows = sample_data.load_response(replay)['dataSet']
+    else:
+        from initial_v2 import all_series
+        server.rows = sample_data.make_dataset(all_series)
+    server.latency = latency
+    server.jitter = jitter
+    server.failure_rate = failure_rate
+    server.slow = dict(slow or {})
+    server.rnd = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/api/post.php"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the censtatd post.php API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random seconds, up to this much")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--replay", help="Recorded post.php response to serve rows from")
+    parser.add_argument("--slow", nargs="+", default=[], metavar="CODE=SECONDS",
+                        help="Extra seconds for requests asking for these OUTLET_TYPE codes")
+    args = parser.parse_args()
+
+    slow = {code: float(seconds) for code, seconds in (item.split("=", 1) for item in args.slow)}
+    server = start_server(args.port, args.latency, args.jitter, args.failure_rate, args.replay, slow=slow)
+    print(f"Serving mock API at {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Synthetic stand-in for censtatd post.php responses
+# Produces rows with the same fields as the live dataSet so benchmarks can run
+# offline; a recorded live response can be used instead wherever a path is accepted
+
+import json
+import os
+import random
+
+SAMPLE_RESPONSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample_response.json")
+
+# Define a function to generate the dataSet rows for the given series codes
+# Includes annual rows and a "Total" series, which the parser must filter out
+def make_dataset(series_list, start="197901", end="202608", seed=0):
+    rnd = random.Random(seed)
+    rows = []
+    for series in list(series_list) + ["1"]:
+        description = "All retail outlets (Total)" if series == "1" else f"Outlet type {series}"
+        level = rnd.uniform(40, 120)
+        year, month = int(start[:4]), int(start[4:])
+        while f"{year}{month:02d}" <= end:
+            level = max(1.0, level * (1 + rnd.gauss(0.002, 0.04)))
+            rows.append(make_row(f"{year}{month:02d}", "M", series, description, round(level, 1)))
+            if month == 12:
+                rows.append(make_row(str(year), "Y", series, description, round(level, 1)))
+                year, month = year + 1, 1
+            else:
+                month += 1
+    return rows
+
+# Define a function to build one dataSet row
+def make_row(period, freq, series, description, figure):
+    return {
+        "period": period,
+        "freq": freq,
+        "OUTLET_TYPE": series,
+        "OUTLET_TYPEDesc": description,
+        "sv": "VOL_IDX_RS",
+        "svDesc": "Volume Index of Retail Sales",
+        "sd_value": "",
+        "figure": figure
+    }
+
+# Define a function to load a saved response, generating a synthetic one if none exists
+def load_response(path=SAMPLE_RESPONSE, series_list=None):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    from initial_v2 import all_series
+    return {"header": {"synthetic": True}, "dataSet": make_dataset(series_list or all_series)}
+
+# Define a function to save a response for later offline runs
+def save_response(response_data, path=SAMPLE_RESPONSE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(response_data, f)
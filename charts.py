@@ -0,0 +1,124 @@
+# Chart rendering for the all-categories dashboard
+# Draws with the object-oriented Figure/Agg API, so no pyplot global state is
+# touched and charts can be rendered side by side in worker processes.
+# matplotlib is only imported by the workers, never by the app process
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+# Define a function to draw one chart from a plain spec and return it as PNG bytes
+# The spec holds only arrays, strings and numbers so it pickles cheaply:
+# x, y, label, color, title, ylabel, zero_line, ylim and dpi
+def render_png(spec):
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.plot(spec['x'], spec['y'], label=spec['label'], linewidth=2.5, color=spec['color'])
+    if spec['zero_line']:
+        ax.axhline(y=0, color='black', linestyle='--', linewidth=1, alpha=0.3)
+    ax.xaxis.set_major_locator(mdates.YearLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+    ax.set_title(spec['title'], fontsize=12, fontweight='bold')
+    ax.set_xlabel('Year', fontsize=10)
+    ax.set_ylabel(spec['ylabel'], fontsize=10)
+    ax.legend(fontsize=9)
+    ax.tick_params(axis='x', labelrotation=45, labelsize=9)
+    ax.grid(True, color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
+
+    # Set y-axis limits if common y-axis is selected
+    if spec['ylim'] is not None:
+        ax.set_ylim(*spec['ylim'])
+
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=spec['dpi'])
+    return buffer.getvalue()
+
+# Define a function to draw a throwaway chart, loading matplotlib and its fonts
+# in a worker before the first real chart needs them
+def warm_up():
+    render_png({'x': [0, 1], 'y': [0, 1], 'label': 'warm-up', 'color': 'black', 'title': '', 'ylabel': '',
+                'zero_line': False, 'ylim': None, 'dpi': 10})
+
+# Define a function to start the process pool charts are rendered in
+# Uses spawn so workers never inherit the web server's threads
+def make_render_pool(max_workers=RENDER_WORKERS):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+# Define a bounded, thread-safe store of rendered charts shared by all sessions
+# Tracks in-flight renders too, so a chart requested by several sessions at
+# once is only rendered once
+class ChartCache:
+    def __init__(self, pool, max_entries):
+        self.pool = pool
+        self.max_entries = max_entries
+        self.images = OrderedDict()
+        self.pending = {}
+        self.warming = None
+        self.lock = threading.Lock()
+
+    # Return the cached PNG for a key, or None
+    def get(self, key):
+        with self.lock:
+            png = self.images.get(key)
+            if png is not None:
+                self.images.move_to_end(key)
+            return png
+
+    # Store a PNG, evicting the least recently used ones beyond max_entries
+    def put(self, key, png):
+        with self.lock:
+            self.images[key] = png
+            self.images.move_to_end(key)
+            while len(self.images) > self.max_entries:
+                self.images.popitem(last=False)
+
+    # Start a worker and warm it up, unless that was done already, so charts
+    # asked for while data is still loading do not wait for the pool to start
+    def warm_up(self):
+        with self.lock:
+            if self.warming is None:
+                try:
+                    self.warming = self.pool.submit(warm_up)
+                except BrokenProcessPool:
+                    pass  # submit() starts a fresh pool
+
+    # Return a future for the chart, submitting a render only if none is running
+    # Finished renders are cached even if the session that asked for them is gone
+    def submit(self, key, spec):
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            try:
+                future = self.pool.submit(render_png, spec)
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool rather than failing every chart
+                self.pool = make_render_pool()
+                future = self.pool.submit(render_png, spec)
+            self.pending[key] = future
+        submitted = time.perf_counter()
+
+        def done(future):
+            metrics.observe('chart_render_seconds', time.perf_counter() - submitted)
+            with self.lock:
+                self.pending.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self.put(key, future.result())
+
+        future.add_done_callback(done)
+        return future
@@ -0,0 +1,169 @@
+# Headless batch exporter for the Hong Kong retail sales dashboard
+# Brings every series up to date through the on-disk store the way the
+# dashboard does (incremental deltas, leases shared with other processes),
+# writes the panel, its analytics, a columnar snapshot (snapshot.py) and every
+# chart to a directory and prints how long each stage took.
+# Meant to run from cron after each monthly release, so the dashboard only
+# reads prebuilt artifacts
+#
+# Usage:
+#   python export.py                                  # writes to ./build
+#   python export.py --out /srv/retail --formats csv parquet
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import as_completed
+
+import analytics
+import charts
+import metrics
+import snapshot
+from streamlit.logger import get_logger
+
+# Outside `streamlit run`, every cached function of the dashboard logs a
+# "No runtime found" warning when it is defined; the exporter has no runtime on purpose.
+# Streamlit hands out the logger it registers here, so the level survives its import
+get_logger("streamlit.runtime.caching.cache_data_api").setLevel(logging.ERROR)
+
+from initial_v2 import (
+    BULK_CHUNK_SIZE, EXPORT_DIR, VOLUME, YOY, Y_AXIS_MODES, all_series, build_panel, chart_spec,
+    common_limits, download_shared, fetch_bulk_data, panel_measure, panel_series, panel_snapshot,
+    panel_version, prebuilt_chart_path, series_frame
+)
+
+# Define a function to return the seconds spent parsing responses so far
+def parse_seconds():
+    return sum(span['total'] for span in metrics.snapshot()['spans'] if span['name'] == 'parse')
+
+# Define a function to flatten the panel to one column per series and measure,
+# using the same column names as the per-series frames
+def flat_panel(panel):
+    flat = panel.copy()
+    flat.columns = [f'{series}_{measure}' for measure, series in panel.columns]
+    return flat
+
+# Define a function to write the panel in each requested format
+def write_panel(panel, out_dir, formats, name="panel"):
+    flat = flat_panel(panel)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "parquet":
+            flat.to_parquet(path)  # Needs pyarrow or fastparquet
+        else:
+            flat.to_csv(path)
+        paths.append(path)
+    return paths
+
+# Define a function to render every chart into the export directory
+def render_charts(panel, data_version, out_dir, y_axis_types):
+    limits = common_limits(panel)
+    jobs = {}
+    with charts.make_render_pool() as pool:
+        for series in panel_series(panel):
+            data_df = series_frame(panel, series)
+            for kind in (VOLUME, YOY):
+                for y_axis_type in y_axis_types:
+                    ylim = limits[kind] if y_axis_type == "Common Y-Axis" else None
+                    path = prebuilt_chart_path(out_dir, data_version, series, kind, y_axis_type)
+                    jobs[pool.submit(charts.render_png, chart_spec(data_df, series, kind, ylim))] = path
+        for future in as_completed(jobs):
+            path = jobs[future]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(future.result())
+    return len(jobs)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the retail sales panel and charts")
+    parser.add_argument("--out", default=EXPORT_DIR, help="Directory to write artifacts to")
+    parser.add_argument("--formats", nargs="+", choices=["csv", "parquet"], default=["csv"],
+                        help="Panel file formats to write")
+    parser.add_argument("--y-axis", choices=["individual", "common", "both"], default="both",
+                        help="Which y-axis modes to render charts for")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE,
+                        help="Series per API request with --no-store; 1 fetches every series separately")
+    parser.add_argument("--no-charts", action="store_true", help="Skip chart rendering")
+    parser.add_argument("--no-snapshot", action="store_true", help="Skip the columnar snapshot")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Fetch the full history without reading or updating the on-disk store")
+    args = parser.parse_args(argv)
+
+    timings = {}
+    os.makedirs(args.out, exist_ok=True)
+
+    # Stored series only ask for the months since their last refresh, and a
+    # dashboard or another export loading at the same time shares the requests
+    start = time.perf_counter()
+    parsed = parse_seconds()
+    if args.no_store:
+        all_data = fetch_bulk_data(all_series, chunk_size=args.chunk_size)
+        errors = {series: "no data returned" for series in all_series if series not in all_data}
+    else:
+        all_data, errors = download_shared(all_series)
+    parsed = parse_seconds() - parsed
+    timings["fetch"] = max(0, time.perf_counter() - start - parsed)
+    timings["parse"] = parsed
+
+    start = time.perf_counter()
+    panel = build_panel({series: all_data[series] for series in all_series if series in all_data})
+    data_version = panel_version(panel)
+    timings["compute"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analytics_panel = analytics.compute(panel_measure(panel, VOLUME))
+    timings["analytics"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    panel_paths = write_panel(panel, args.out, args.formats)
+    panel_paths += write_panel(analytics_panel, args.out, args.formats, name="analytics")
+    timings["write"] = time.perf_counter() - start
+
+    # Snapshots are kept per release; an unchanged one is not rewritten
+    snapshot_info = None
+    if not args.no_snapshot and len(panel):
+        start = time.perf_counter()
+        path, written = snapshot.write(panel_snapshot(panel, data_version), os.path.join(args.out, "snapshots"))
+        timings["snapshot"] = time.perf_counter() - start
+        snapshot_info = {"path": os.path.relpath(path, args.out), "release": os.path.basename(path),
+                         "written": written}
+
+    chart_count = 0
+    if not args.no_charts:
+        start = time.perf_counter()
+        y_axis_types = [name for name, mode in Y_AXIS_MODES.items() if args.y_axis in (mode, "both")]
+        chart_count = render_charts(panel, data_version, args.out, y_axis_types)
+        timings["render"] = time.perf_counter() - start
+
+    missing = [series for series in all_series if series not in all_data]
+    manifest = {
+        "data_version": data_version,
+        "latest_period": panel.index.max().strftime('%Y%m') if len(panel) else None,
+        "series": panel_series(panel),
+        "missing": missing,
+        "errors": {series: str(error) for series, error in errors.items()},
+        "panel_files": [os.path.basename(path) for path in panel_paths],
+        "snapshot": snapshot_info,
+        "charts": chart_count,
+        "timings": timings,
+        "exported_at": time.time()
+    }
+    with open(os.path.join(args.out, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    metrics.write_metrics_file()
+
+    print(f"Exported {len(all_data)} of {len(all_series)} series and {chart_count} charts to {args.out}")
+    for stage, seconds in timings.items():
+        print(f"  {stage:8s} {seconds * 1000:10.1f} ms")
+    print(f"  {'total':8s} {sum(timings.values()) * 1000:10.1f} ms")
+    if missing:
+        print(f"Missing series: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
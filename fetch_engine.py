@@ -0,0 +1,100 @@
+# Concurrent fetch engine for the census and statistics department API
+# Shares one pooled HTTP session, retries with backoff and jitter, and
+# enforces a deadline across a whole batch of fetches. requests is imported on
+# first use, so processes serving only stored data never load it
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metrics
+
+API_URL = os.environ.get("HK_RETAIL_API_URL", "https://www.censtatd.gov.hk/api/post.php")
+REQUEST_TIMEOUT = 20       # Seconds allowed for a single POST
+MAX_WORKERS = 8            # Concurrent requests against the API
+MAX_RETRIES = 3            # Extra attempts after the first failure
+BACKOFF_BASE = 0.5         # Seconds, doubled on each retry
+BACKOFF_MAX = 8.0          # Upper bound for a single backoff sleep
+BATCH_DEADLINE = 45        # Seconds allowed for a whole dashboard load
+
+_session = None
+_session_lock = threading.Lock()
+
+# Define a function to return the shared, connection-pooled session
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+# Define a function to work out the absolute deadline for a batch
+def make_deadline(seconds=BATCH_DEADLINE):
+    return time.monotonic() + seconds
+
+# Define a function to POST a query, retrying failures until the deadline
+def post_query(parameters, deadline=None):
+    import requests
+
+    data = {'query': json.dumps(parameters)}
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        timeout = REQUEST_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+        try:
+            with metrics.span('http_post'):
+                r = get_session().post(API_URL, data=data, timeout=timeout)
+            metrics.observe('payload_bytes', len(r.content))
+            r.raise_for_status()
+            with metrics.span('json_decode'):
+                return r.json()
+        except (requests.RequestException, ValueError) as e:
+            metrics.count('http_error', error=type(e).__name__)
+            last_error = e
+        if attempt == MAX_RETRIES:
+            break
+        # Exponential backoff with full jitter so parallel retries spread out
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            break
+        metrics.count('http_retry')
+        time.sleep(delay)
+    if last_error is None:
+        raise TimeoutError("Deadline exceeded before the request could be sent")
+    raise last_error
+
+# Define a function to run func(key, deadline) for every key in parallel
+# Returns the results that finished in time and the error for every missing key
+def fetch_many(func, keys, max_workers=MAX_WORKERS, deadline=None):
+    if deadline is None:
+        deadline = make_deadline()
+    results = {}
+    missing = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(func, key, deadline): key for key in keys}
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    for future in done:
+        key = futures[future]
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            missing[key] = str(e)
+    for future in not_done:
+        future.cancel()
+        missing[futures[future]] = "Deadline exceeded"
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results, missing
@@ -1,12 +1,12 @@
 # Hong Kong api to download Jewellry volume and value 
 
 import streamlit as st
-import requests
-import json
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+import fetch_engine
+
 # Define all available series
 all_series = ['2', '8', '9', '12', '18', '30', '32', '35', '49', '3', '4', '5', '6', '7', '13', '14', '19', '23', '51', '36', '37', '38', '39', '40']
 
@@ -38,10 +38,8 @@ series_dict = {
     "51": "Electrical goods and other consumer durable goods not elsewhere"
 }
 
-# Define a function to fetch and process the data
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def fetch_data(series):
-    url = "https://www.censtatd.gov.hk/api/post.php"
+# Define a function to fetch and process the data (uncached, safe to run in worker threads)
+def fetch_series(series, deadline=None):
     parameters = {
         "cv": {
             "OUTLET_TYPE": [series]
@@ -55,9 +53,7 @@ def fetch_data(series):
         "id": "620-67003",
         "lang": "en"
     }
-    data = {'query': json.dumps(parameters)}
-    r = requests.post(url, data=data, timeout=20)
-    response_data = r.json()
+    response_data = fetch_engine.post_query(parameters, deadline)
     df = pd.DataFrame(response_data['dataSet'])
     df = df[~df['freq'].str.contains('Y')]
     df = df[~df['OUTLET_TYPEDesc'].str.contains('Total')]
@@ -72,6 +68,19 @@ def fetch_data(series):
     data_df.set_index('period', inplace=True)
     return data_df
 
+# Define a cached wrapper around fetch_series
+@st.cache_data(ttl=3600)  # Cache for 1 hour
+def fetch_data(series):
+    return fetch_series(series)
+
+# Define a function to fetch all series concurrently within one deadline
+@st.cache_data(ttl=3600)
+def fetch_all_data():
+    all_data, missing = fetch_engine.fetch_many(fetch_series, all_series)
+    for series, error in missing.items():
+        st.warning(f"Failed to fetch data for series {series}: {error}")
+    return {series: all_data[series] for series in all_series if series in all_data}
+
 # Define a function to plot the data
 def plot_data(data_df, series):
     series_description = series_dict[series]
@@ -101,6 +110,9 @@ def plot_data(data_df, series):
 
 # Define a function to plot all categories
 def plot_definitions():
+    # Fetch all data first
+    all_data = fetch_all_data()
+
     # Create tabs for better organization
     tab1, tab2 = st.tabs(["📊 Volume Index", "📈 Year-on-Year Change"])
     
@@ -113,9 +125,12 @@ def plot_definitions():
                 if i + j < len(all_series):
                     series = all_series[i + j]
                     with cols[j]:
+                        series_description = series_dict[series]
+                        if series not in all_data:
+                            st.warning(f"No data available for {series_description}")
+                            continue
                         try:
-                            data_df = fetch_data(series)
-                            series_description = series_dict[series]
+                            data_df = all_data[series]
                             fig, ax = plt.subplots(figsize=(10, 5))
                             ax.plot(data_df.index, data_df[f'{series}_volume_index'], 
                                    label=f'{series_description}', linewidth=2.5, color='#1f77b4')
@@ -141,9 +156,12 @@ def plot_definitions():
                 if i + j < len(all_series):
                     series = all_series[i + j]
                     with cols[j]:
+                        series_description = series_dict[series]
+                        if series not in all_data:
+                            st.warning(f"No data available for {series_description}")
+                            continue
                         try:
-                            data_df = fetch_data(series)
-                            series_description = series_dict[series]
+                            data_df = all_data[series]
                             fig, ax = plt.subplots(figsize=(10, 5))
                             ax.plot(data_df.index, data_df[f'{series}_volume_index_yoy'], 
                                    label='YoY Change', linewidth=2.5, color='#ff7f0e')
@@ -190,14 +208,14 @@ def main():
         
         # Show latest data for each category in expanders
         st.subheader("📋 Latest Data")
+        all_data = fetch_all_data()
         for series in all_series:
-            try:
-                data_df = fetch_data(series)
-                series_description = series_dict[series]
-                with st.expander(f"🔍 {series_description}"):
-                    st.dataframe(data_df.tail(), use_container_width=True)
-            except Exception as e:
-                st.error(f"Error loading {series_dict[series]}: {str(e)}")
+            if series not in all_data:
+                st.error(f"Error loading {series_dict[series]}: no data returned")
+                continue
+            series_description = series_dict[series]
+            with st.expander(f"🔍 {series_description}"):
+                st.dataframe(all_data[series].tail(), use_container_width=True)
 
     # Display attribution and caution
     st.markdown("""
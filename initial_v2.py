@@ -1,14 +1,27 @@
 # Hong Kong api to download Jewellry volume and value 
 # Version 2 - With y-axis scaling options
 
+import functools
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
 import streamlit as st
-import requests
-import json
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import numpy as np
 
+import analytics
+import api_periods
+import charts
+import fetch_engine
+import interactive
+import metrics
+import query_engine
+import series_store
+import snapshot
+
 # Define all available series
 all_series = ['2', '8', '9', '12', '18', '30', '32', '35', '49', '3', '4', '5', '6', '7', '13', '14', '19', '23', '51', '36', '37', '38', '39', '40']
 
@@ -40,53 +53,483 @@ series_dict = {
     "51": "Electrical goods and other consumer durable goods not elsewhere"
 }
 
-# Define a function to fetch and process the data
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def fetch_data(series):
-    url = "https://www.censtatd.gov.hk/api/post.php"
-    parameters = {
-        "cv": {
-            "OUTLET_TYPE": [series]
-        },
-        "sv": {
-            "VOL_IDX_RS": ["Raw_1dp_idx_n"]
-        },
-        "period": {
-            "start": "197901"
-        },
-        "id": "620-67003",
-        "lang": "en"
+# Define the table, statistic and bulk query size used for every request
+TABLE_ID = "620-67003"
+SV_CODE = "VOL_IDX_RS"
+BULK_CHUNK_SIZE = 24
+
+# Define the first period of the full history and how many months before the
+# latest stored period an incremental refresh asks for again, to pick up revisions
+HISTORY_START = "197901"
+OVERLAP_MONTHS = 3
+
+# Define a function to build the API query for one or more series
+def build_query(series_list, start=HISTORY_START):
+    return query_engine.build_parameters(
+        TABLE_ID, {"OUTLET_TYPE": series_list}, {SV_CODE: ["Raw_1dp_idx_n"]}, start
+    )
+
+# Define a function to parse a response into one frame per requested series
+# Rows are filtered on their exact frequency, statistic and OUTLET_TYPE codes,
+# periods are parsed in one pass and YoY is computed for all series at once
+@metrics.span('parse')
+def parse_dataset(dataset, series_list):
+    codes = set(series_list)
+    rows = [
+        (row['OUTLET_TYPE'], row['period'], row['figure'])
+        for row in dataset
+        if row['freq'] == 'M' and row['sv'] == SV_CODE and row['OUTLET_TYPE'] in codes
+    ]
+    if not rows:
+        return {}
+    outlets, periods, figures = zip(*rows)
+    outlets = np.array(outlets)
+    periods = np.array(periods, dtype=np.int64)
+    try:
+        figures = np.array(figures, dtype='float64')
+    except (TypeError, ValueError):
+        figures = pd.to_numeric(pd.Series(figures), errors='coerce').to_numpy(dtype='float64')
+
+    # Sort by series then period, so every series is one contiguous block
+    order = np.lexsort((periods, outlets))
+    outlets, periods, figures = outlets[order], periods[order], figures[order]
+
+    # YYYYMM to month-start timestamps by integer arithmetic, no string parsing
+    index = api_periods.period_index(periods, 'M')
+
+    # YoY against the value 12 rows earlier in the same series, as pct_change(12) does
+    previous = np.full(len(figures), np.nan)
+    previous[12:] = np.where(outlets[12:] == outlets[:-12], figures[:-12], np.nan)
+    yoy = (figures / previous - 1) * 100
+
+    all_data = {}
+    starts = np.flatnonzero(np.r_[True, outlets[1:] != outlets[:-1]])
+    ends = np.r_[starts[1:], len(outlets)]
+    for start, end in zip(starts, ends):
+        series = str(outlets[start])
+        all_data[series] = pd.DataFrame({
+            f'{series}_volume_index': figures[start:end],
+            f'{series}_volume_index_yoy': yoy[start:end]
+        }, index=index[start:end])
+    return all_data
+
+# Define a function to fetch and process the data (uncached, safe to run in worker threads)
+def fetch_series(series, deadline=None, start=HISTORY_START):
+    response_data = fetch_engine.post_query(build_query([series], start), deadline)
+    all_data = parse_dataset(response_data['dataSet'], [series])
+    if series not in all_data:
+        raise ValueError(f"No data returned for series {series}")
+    return all_data[series]
+
+# Define functions to convert between series frames and the store's column names
+def to_store_frame(data_df):
+    return data_df.set_axis(['figure', 'yoy'], axis=1)
+
+def from_store_frame(series, frame):
+    return frame.set_axis([f'{series}_volume_index', f'{series}_volume_index_yoy'], axis=1)
+
+# Define a function to work out where an incremental refresh should start
+def delta_start(latest_period):
+    if latest_period is None:
+        return HISTORY_START
+    start = pd.Period(latest_period, freq='M') - OVERLAP_MONTHS
+    return max(start.strftime('%Y%m'), HISTORY_START)
+
+# Define a function to merge newly fetched figures into a stored series frame
+# Only the rows from the first new or revised period onward get a fresh YoY;
+# returns the merged frame and those tail rows
+def merge_delta(series, data_df, figures):
+    vol_col = f'{series}_volume_index'
+    yoy_col = f'{series}_volume_index_yoy'
+    figures = figures.astype('float64')
+    old = data_df[vol_col].reindex(figures.index)
+    changed = figures.index[(old != figures) & ~(old.isna() & figures.isna())]
+    if len(changed) == 0:
+        return data_df, data_df.iloc[0:0]
+
+    merged = data_df.reindex(data_df.index.union(figures.index))
+    merged.loc[figures.index, vol_col] = figures
+    pos = merged.index.get_loc(changed.min())
+    lookback = max(0, pos - 12)
+    tail_yoy = merged[vol_col].iloc[lookback:].pct_change(12) * 100
+    merged.iloc[pos:, merged.columns.get_loc(yoy_col)] = tail_yoy.iloc[pos - lookback:].to_numpy()
+    return merged, merged.iloc[pos:]
+
+# Define a function to apply fetched figures to a stored series and persist the result
+def apply_delta(series, data_df, delta_df):
+    merged, tail = merge_delta(series, data_df, delta_df[f'{series}_volume_index'])
+    series_store.merge_series(TABLE_ID, series, SV_CODE, to_store_frame(tail))
+    return merged
+
+# Define a function to write a complete series frame to the on-disk store
+def store_series(series, data_df):
+    series_store.save_series(TABLE_ID, series, SV_CODE, to_store_frame(data_df))
+
+# Define a function to return the key of a series in the store
+def store_key(series):
+    return (TABLE_ID, series, SV_CODE)
+
+# Define a function to read a series frame and its metadata from the store
+def load_stored(series):
+    stored = series_store.load_series(*store_key(series))
+    if stored is None:
+        return None
+    frame, meta = stored
+    return from_store_frame(series, frame), meta
+
+# Define a function to read the frames and metadata of several series from the
+# store in one query; series the store does not hold are left out
+def load_all_stored(series_list):
+    stored = series_store.load_all_series(TABLE_ID, SV_CODE, series_list)
+    return {
+        series: (from_store_frame(series, stored[series][0]), stored[series][1])
+        for series in series_list if series in stored
     }
-    data = {'query': json.dumps(parameters)}
-    r = requests.post(url, data=data, timeout=20)
-    response_data = r.json()
-    df = pd.DataFrame(response_data['dataSet'])
-    df = df[~df['freq'].str.contains('Y')]
-    df = df[~df['OUTLET_TYPEDesc'].str.contains('Total')]
-    df = df[df['svDesc'].str.contains('Index')]
-    df = df.drop(['sv', 'sd_value'], axis=1)
-    data_df = df[['period', 'figure']].copy()
-    data_df.loc[:, 'period'] = pd.to_datetime(data_df['period'], format='%Y%m').dt.strftime('%Y-%m-%d')
-    data_df = data_df.sort_values(by='period')
-    data_df = data_df.rename(columns={'figure': f'{series}_volume_index'})
-    data_df[f'{series}_volume_index_yoy'] = data_df[f'{series}_volume_index'].pct_change(12) * 100
-    data_df['period'] = pd.to_datetime(data_df['period'])
-    data_df.set_index('period', inplace=True)
+
+# Define a function to bring a series up to date from the API and keep it on disk
+# Stored series only ask for the months after their latest period
+def refresh_series(series, deadline=None):
+    stored = load_stored(series)
+    if stored is None:
+        data_df = fetch_series(series, deadline)
+        store_series(series, data_df)
+        return data_df
+    data_df, meta = stored
+    delta_df = fetch_series(series, deadline, start=delta_start(meta['latest_period']))
+    return apply_delta(series, data_df, delta_df)
+
+# Define a function to read a series from the store, falling back to the API
+# Stale series are served from disk while a background refresh runs
+def load_series(series, deadline=None):
+    stored = load_stored(series)
+    if stored is None:
+        metrics.count('store_miss', series=series)
+        all_data, missing = download_shared([series], deadline)
+        if series not in all_data:
+            raise ValueError(f"Failed to fetch data for series {series}: {missing.get(series)}")
+        return all_data[series]
+    metrics.count('store_hit', series=series)
+    data_df, meta = stored
+    if series_store.is_stale(meta):
+        series_store.refresh_in_background(store_key(series), lambda: revalidate_series([series]))
     return data_df
 
+# Define a cached wrapper around load_series
+# Its body only runs on a cache miss, which is what the counter records
+@st.cache_data(ttl=3600)  # Cache for 1 hour
+def cached_series(series):
+    metrics.count('cache_miss', cache='fetch_data', series=series)
+    return load_series(series)
+
+# Define a function to fetch one series through the cache, timing every call
+def fetch_data(series):
+    metrics.count('cache_request', cache='fetch_data', series=series)
+    with metrics.span('fetch_data', series=series):
+        return cached_series(series)
+
+# Define a function to fetch and parse one chunk of series
+def fetch_bulk_chunk(chunk, deadline=None, start=HISTORY_START):
+    response_data = fetch_engine.post_query(build_query(chunk, start), deadline)
+    return parse_dataset(response_data['dataSet'], chunk)
+
+# Define a function to fetch several series with one request per chunk
+def fetch_bulk_data(series_list, chunk_size=BULK_CHUNK_SIZE, deadline=None, start=HISTORY_START):
+    chunks = [tuple(series_list[i:i + chunk_size]) for i in range(0, len(series_list), chunk_size)]
+    fetch_chunk = functools.partial(fetch_bulk_chunk, start=start)
+    parsed, _ = fetch_engine.fetch_many(fetch_chunk, chunks, deadline=deadline)
+    all_data = {}
+    for chunk_data in parsed.values():
+        all_data.update(chunk_data)
+    return all_data
+
+# Define a function to download several series and keep them on disk
+# Stored series get one bulk delta query from the earliest refresh start, new
+# series get their full history, and anything still missing is fetched one by
+# one concurrently, all within one deadline; returns the frames and an error
+# for each missing series
+def download_series(series_list, deadline=None):
+    if deadline is None:
+        deadline = fetch_engine.make_deadline()
+    stored = load_all_stored(series_list)
+    known = [series for series in series_list if series in stored]
+    new = [series for series in series_list if series not in stored]
+
+    all_data = {}
+    if known:
+        start = min(delta_start(stored[series][1]['latest_period']) for series in known)
+        try:
+            deltas = fetch_bulk_data(known, deadline=deadline, start=start)
+        except Exception:
+            deltas = {}
+        for series, delta_df in deltas.items():
+            all_data[series] = apply_delta(series, stored[series][0], delta_df)
+    if new:
+        try:
+            fetched = fetch_bulk_data(new, deadline=deadline)
+        except Exception:
+            fetched = {}
+        for series, data_df in fetched.items():
+            store_series(series, data_df)
+            all_data[series] = data_df
+
+    remaining = [series for series in series_list if series not in all_data]
+    missing = {}
+    if remaining:
+        fetched, missing = fetch_engine.fetch_many(refresh_series, remaining, deadline=deadline)
+        all_data.update(fetched)
+    return all_data, missing
+
+# Define a function to download series once across every process sharing the store
+# Series this process holds the lease on are downloaded here; for the others it
+# waits until the process holding their lease is done and reads its result from
+# the store, downloading only what is still missing after that
+def download_shared(series_list, deadline=None):
+    if deadline is None:
+        deadline = fetch_engine.make_deadline()
+    keys = {store_key(series): series for series in series_list}
+    with series_store.leases(keys) as held:
+        leading = [keys[key] for key in held]
+        all_data, missing = download_series(leading, deadline) if leading else ({}, {})
+    waiting = [series for series in series_list if series not in leading]
+    if waiting:
+        metrics.count('single_flight', len(waiting), role='follower')
+        timeout = min(series_store.LEASE_SECONDS, max(0, deadline - time.monotonic()))
+        series_store.wait_for_leases([store_key(series) for series in waiting], timeout)
+        for series, (data_df, _) in load_all_stored(waiting).items():
+            all_data[series] = data_df
+        remaining = [series for series in waiting if series not in all_data]
+        if remaining:
+            fetched, failed = download_series(remaining, deadline)
+            all_data.update(fetched)
+            missing.update(failed)
+    metrics.count('single_flight', len(leading), role='leader')
+    return all_data, missing
+
+# Define a function to refresh stale series, meant to run in the background
+# Series another process is refreshing, or has refreshed meanwhile, are skipped
+def revalidate_series(series_list):
+    keys = {store_key(series): series for series in series_list}
+    with series_store.leases(keys) as held:
+        stored = load_all_stored([keys[key] for key in held])
+        stale = [
+            keys[key] for key in held
+            if keys[key] not in stored or series_store.is_stale(stored[keys[key]][1])
+        ]
+        metrics.count('revalidate', len(stale), result='refreshed')
+        metrics.count('revalidate', len(series_list) - len(stale), result='skipped')
+        if stale:
+            download_series(stale)
+
 # Define a function to fetch all data
+# Stored series are served from disk; stale ones are refreshed in the background
 @st.cache_data(ttl=3600)
+def cached_all_data():
+    metrics.count('cache_miss', cache='fetch_all_data')
+    all_data = {}
+    stale = []
+    for series, (data_df, meta) in load_all_stored(all_series).items():
+        all_data[series] = data_df
+        if series_store.is_stale(meta):
+            stale.append(series)
+    if stale:
+        series_store.refresh_in_background((TABLE_ID, tuple(stale), SV_CODE), lambda: revalidate_series(stale))
+
+    remaining = [series for series in all_series if series not in all_data]
+    if remaining:
+        fetched, missing = download_shared(remaining)
+        all_data.update(fetched)
+        for series, error in missing.items():
+            st.warning(f"Failed to fetch data for series {series}: {error}")
+    return {series: all_data[series] for series in all_series if series in all_data}
+
+# Define a function to fetch all data through the cache, timing every call
 def fetch_all_data():
+    metrics.count('cache_request', cache='fetch_all_data')
+    with metrics.span('fetch_all_data'):
+        return cached_all_data()
+
+# Define a function to start loading series for a progressive page
+# Returns the frames the store already holds, refreshing stale ones in the
+# background, and a future per series that has to be downloaded; every download
+# is its own request, so each series arrives as soon as its own response does
+def start_series_load(series_list, deadline=None):
+    if deadline is None:
+        deadline = fetch_engine.make_deadline()
     all_data = {}
-    for series in all_series:
-        try:
-            all_data[series] = fetch_data(series)
-        except Exception as e:
-            st.warning(f"Failed to fetch data for series {series}: {str(e)}")
-    return all_data
+    stale = []
+    for series, (data_df, meta) in load_all_stored(series_list).items():
+        all_data[series] = data_df
+        if series_store.is_stale(meta):
+            stale.append(series)
+    if stale:
+        series_store.refresh_in_background((TABLE_ID, tuple(stale), SV_CODE), lambda: revalidate_series(stale))
+
+    remaining = [series for series in series_list if series not in all_data]
+    downloads = {}
+    if remaining:
+        executor = ThreadPoolExecutor(max_workers=fetch_engine.MAX_WORKERS)
+        downloads = {executor.submit(download_shared, [series], deadline): series for series in remaining}
+        executor.shutdown(wait=False)
+    return all_data, downloads
+
+# Define a function to tell whether every series can be read from the store
+def all_series_stored():
+    return set(all_series) <= set(series_store.list_series(TABLE_ID, SV_CODE))
+
+# Define a function to fetch any table, filters and measures as one aligned frame
+# Goes through the query engine, so overlapping queries (value next to volume,
+# a second table) only request what is not already memoized, e.g.
+# fetch_query(TABLE_ID, {"OUTLET_TYPE": ["2", "8"]}, {SV_CODE: ["Raw_1dp_idx_n"]})
+def fetch_query(table_id, cv, sv, start=HISTORY_START, end=None, freq='M'):
+    return query_engine.run_query(query_engine.make_query(table_id, cv, sv, start, end, freq))
+
+# Define the measures held in the panel
+VOLUME = 'volume_index'
+YOY = 'volume_index_yoy'
+
+# Define a function to build one wide, float-typed monthly panel from the
+# per-series frames, with columns (measure, series) and YoY for every series
+# computed in one pass
+def build_panel(all_data):
+    volume = pd.DataFrame(
+        {series: data_df[f'{series}_volume_index'] for series, data_df in all_data.items()},
+        dtype='float64'
+    )
+    if volume.empty:
+        # No series at all: keep the (measure, series) layout, with no columns in it
+        columns = pd.MultiIndex.from_product([[VOLUME, YOY], []])
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='period'), columns=columns, dtype='float64')
+    volume = volume.asfreq('MS')
+    volume.index.name = 'period'
+    yoy = volume.pct_change(12, fill_method=None) * 100
+    return pd.concat({VOLUME: volume, YOY: yoy}, axis=1)
+
+# Define a cached function returning the panel of all series
+@st.cache_data(ttl=3600)
+def fetch_panel():
+    return build_panel(fetch_all_data())
+
+# Define a function to build the state the all-categories views share from a
+# panel: the panel, its version, the series with data and the common y-axis
+# limits. It is shared by all sessions, so it must not be modified
+def make_app_state(panel):
+    available = panel_series(panel)
+    return {
+        'panel': panel,
+        'version': panel_version(panel),
+        'available': available,
+        'missing': [series for series in all_series if series not in available],
+        'limits': common_limits(panel) if len(panel) else None
+    }
+
+# Define how long a prebuilt state is served before it is built again
+APP_STATE_TTL = 3600
+
+# Define a cached app state, built once per panel rather than on every rerun
+@st.cache_resource(ttl=APP_STATE_TTL)
+def get_app_state():
+    state = make_app_state(fetch_panel())
+    get_load_state()['built'] = True
+    return state
+
+# Define a shared record of whether this process has built the app state, and
+# of the last state a progressive load built, with the time it was built
+@st.cache_resource
+def get_load_state():
+    return {'built': False, 'progressive': None}
+
+# Define a function to return the app state if it is available without waiting
+# on the API, or None while some series still have to be downloaded, in which
+# case the static charts load progressively. The state a progressive load built
+# is served like a cached one, so series it left out are retried when it expires
+def ready_app_state():
+    load_state = get_load_state()
+    progressive = load_state['progressive']
+    if not load_state['built'] and progressive is not None and time.time() - progressive[0] < APP_STATE_TTL:
+        return progressive[1]
+    if load_state['built'] or all_series_stored():
+        return get_app_state()
+    return None
+
+# Define a shared holder of the latest analytics, so a new panel only
+# recomputes the months that changed since the previous one
+@st.cache_resource
+def get_analytics_state():
+    return {'result': None, 'lock': threading.Lock()}
+
+# Define a function to bring the shared analytics up to date with a panel
+def refresh_analytics(panel):
+    state = get_analytics_state()
+    with state['lock']:
+        with metrics.span('analytics'):
+            result, since = analytics.update(state['result'], panel_measure(panel, VOLUME))
+        if since is not None:
+            metrics.count('analytics_update', result='full' if state['result'] is None else 'incremental')
+        state['result'] = result
+    return result
+
+# Define a cached function returning the analytics of all series, with
+# (measure, series) columns
+@st.cache_data(ttl=3600)
+def fetch_analytics():
+    return refresh_analytics(fetch_panel())
+
+# Define a cached function returning the latest-month ranking and the
+# correlation of month-on-month changes across series
+@st.cache_data(ttl=3600)
+def fetch_analytics_tables():
+    result = fetch_analytics()
+    return analytics.ranking_table(result), analytics.correlation_table(result)
+
+# Define a function to build the columnar snapshot of a panel, shared with the exporter
+def panel_snapshot(panel, data_version):
+    return snapshot.build(
+        panel, data_version, series_dict, table_id=TABLE_ID, sv_code=SV_CODE,
+        source=f"https://www.censtatd.gov.hk/en/web_table.html?id={TABLE_ID}"
+    )
+
+# Define a cached function returning the release and Arrow file of one panel version
+@st.cache_data(max_entries=2)
+def snapshot_file(_panel, data_version):
+    values, periods, meta = panel_snapshot(_panel, data_version)
+    return meta['release'], snapshot.arrow_bytes(values, periods, meta)
+
+# Define a function to select one measure of the panel, one column per series
+# pandas cannot select from a panel without columns, so that gets an empty frame
+def panel_measure(panel, measure):
+    if panel.columns.empty:
+        return pd.DataFrame(index=panel.index, dtype='float64')
+    return panel[measure]
+
+# Define a function to list the series held in the panel
+def panel_series(panel):
+    return list(panel_measure(panel, VOLUME).columns)
+
+# Define a function to extract one series from the panel with its usual column names
+def series_frame(panel, series):
+    data_df = pd.DataFrame({
+        f'{series}_volume_index': panel[(VOLUME, series)],
+        f'{series}_volume_index_yoy': panel[(YOY, series)]
+    })
+    volume = data_df[f'{series}_volume_index']
+    return data_df.loc[volume.first_valid_index():volume.last_valid_index()]
+
+# Define a function to return the smallest and largest value of a measure across all series
+def panel_extrema(panel, measure):
+    values = panel[measure].to_numpy()
+    return np.nanmin(values), np.nanmax(values)
+
+# Define a function to return the latest rows of one series
+def latest_rows(panel, series, n=5):
+    return series_frame(panel, series).tail(n)
 
 # Define a function to plot the data
+# pyplot is imported here, as only this view needs it in the app process
+@metrics.span('plot_data')
 def plot_data(data_df, series):
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
     series_description = series_dict[series]
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(data_df.index, data_df[f'{series}_volume_index'], label=f'{series_description} volume Index')
@@ -98,7 +541,9 @@ def plot_data(data_df, series):
     ax.legend()
     plt.xticks(rotation=45)
     plt.grid(True, color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
-    st.pyplot(fig)
+    with metrics.span('figure_render', chart='plot_data'):
+        st.pyplot(fig)
+    plt.close(fig)
 
     fig, ax2 = plt.subplots(figsize=(10, 5))
     ax2.plot(data_df.index, data_df[f'{series}_volume_index_yoy'], label='Volume Index YoY Change')
@@ -110,111 +555,407 @@ def plot_data(data_df, series):
     ax2.legend()
     plt.xticks(rotation=45)
     plt.grid(True, color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
-    st.pyplot(fig)
+    with metrics.span('figure_render', chart='plot_data'):
+        st.pyplot(fig)
+    plt.close(fig)
+
+# Define the resolution of dashboard chart images and how many to keep cached
+# 10in at 140dpi stays under Streamlit's 1460px image width, so st.image sends
+# the cached bytes as they are instead of resizing and re-encoding them
+CHART_DPI = 140
+CHART_CACHE_ENTRIES = 200
+
+# Define the chart types of the all-categories view and how many charts a page reveals
+CHART_TYPES = {"📊 Volume Index": VOLUME, "📈 Year-on-Year Change": YOY}
+CHARTS_PER_PAGE = 8
+
+# Define the y-axis modes and the short names used in prebuilt chart file names
+Y_AXIS_MODES = {"Individual Y-Axis": "individual", "Common Y-Axis": "common"}
+
+# Define how the all-categories view can be drawn: as images rendered on the
+# server, or as charts drawn in the browser from the raw series
+RENDER_MODES = {"🖼️ Static Images": "static", "🖱️ Interactive": "interactive"}
+
+# Define the chart types of the interactive view, styled like chart_spec
+INTERACTIVE_KINDS = [
+    {'key': VOLUME, 'name': "📊 Volume Index", 'suffix': '', 'unit': '',
+     'color': '#1f77b4', 'zero_line': False},
+    {'key': YOY, 'name': "📈 Year-on-Year Change", 'suffix': ' YoY', 'unit': '%',
+     'color': '#ff7f0e', 'zero_line': True}
+]
+
+# Define where the batch exporter (export.py) writes its artifacts
+EXPORT_DIR = os.environ.get(
+    "HK_RETAIL_EXPORT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "build")
+)
+
+# Define a function to work out the y-axis limits shared by all charts in
+# Common Y-Axis mode, keyed by measure
+def common_limits(panel):
+    volume_min, volume_max = panel_extrema(panel, VOLUME)
+    yoy_min, yoy_max = panel_extrema(panel, YOY)
+
+    # Add some padding
+    volume_min = volume_min * 0.9
+    volume_max = volume_max * 1.1
+    yoy_min = yoy_min * 1.1 if yoy_min < 0 else yoy_min * 0.9
+    yoy_max = yoy_max * 1.1 if yoy_max > 0 else yoy_max * 0.9
+    return {VOLUME: (volume_min, volume_max), YOY: (yoy_min, yoy_max)}
+
+# Define a function to fingerprint the panel, so cached charts follow data changes
+def panel_version(panel):
+    digest = hashlib.sha1(panel.to_numpy().tobytes())
+    digest.update(panel.index.asi8.tobytes())
+    digest.update(repr(list(panel.columns)).encode())
+    return digest.hexdigest()
+
+# Define a function to describe one dashboard chart as a plain, picklable spec
+def chart_spec(data_df, series, kind, ylim=None):
+    series_description = series_dict[series]
+    spec = {
+        'x': data_df.index.to_numpy(),
+        'y': data_df[f'{series}_{kind}'].to_numpy(),
+        'ylim': ylim,
+        'dpi': CHART_DPI
+    }
+    if kind == VOLUME:
+        spec.update(label=f'{series_description}', color='#1f77b4', title=f'{series_description}',
+                    ylabel='Index', zero_line=False)
+    else:
+        spec.update(label='YoY Change', color='#ff7f0e', title=f'{series_description} YoY',
+                    ylabel='Percentage Change (%)', zero_line=True)
+    return spec
+
+# Define a function to return where the exporter keeps a prebuilt chart
+def prebuilt_chart_path(export_dir, data_version, series, kind, y_axis_type):
+    return os.path.join(export_dir, "charts", data_version[:16], kind,
+                        f"{series}_{Y_AXIS_MODES[y_axis_type]}.png")
+
+# Define a function to read a prebuilt chart, or return None if there is none
+def load_prebuilt_chart(data_version, series, kind, y_axis_type):
+    path = prebuilt_chart_path(EXPORT_DIR, data_version, series, kind, y_axis_type)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# Define a shared cache of rendered charts, backed by the render process pool
+@st.cache_resource
+def get_chart_cache():
+    return charts.ChartCache(charts.make_render_pool(), CHART_CACHE_ENTRIES)
 
 # Define a function to plot all categories with y-axis option
-def plot_definitions(y_axis_type):
+# Every slot gets a placeholder first; cached charts are shown straight away and
+# the rest are rendered in parallel and shown as each one finishes
+@metrics.span('plot_definitions')
+def plot_definitions(y_axis_type, state=None):
     # Fetch all data first
-    all_data = fetch_all_data()
-    
-    # Calculate global min/max for common y-axis
-    if y_axis_type == "Common Y-Axis":
-        volume_min = float('inf')
-        volume_max = float('-inf')
-        yoy_min = float('inf')
-        yoy_max = float('-inf')
-        
-        for series, data_df in all_data.items():
-            vol_col = f'{series}_volume_index'
-            yoy_col = f'{series}_volume_index_yoy'
-            if vol_col in data_df.columns:
-                volume_min = min(volume_min, data_df[vol_col].min())
-                volume_max = max(volume_max, data_df[vol_col].max())
-            if yoy_col in data_df.columns:
-                yoy_min = min(yoy_min, data_df[yoy_col].min())
-                yoy_max = max(yoy_max, data_df[yoy_col].max())
-        
-        # Add some padding
-        volume_min = volume_min * 0.9
-        volume_max = volume_max * 1.1
-        yoy_min = yoy_min * 1.1 if yoy_min < 0 else yoy_min * 0.9
-        yoy_max = yoy_max * 1.1 if yoy_max > 0 else yoy_max * 0.9
-    
-    # Create tabs for better organization
-    tab1, tab2 = st.tabs(["📊 Volume Index", "📈 Year-on-Year Change"])
-    
-    with tab1:
+    state = state or get_app_state()
+    panel = state['panel']
+    available = set(state['available'])
+    data_version = state['version']
+
+    # Global min/max for common y-axis, precomputed with the state
+    limits = state['limits'] if y_axis_type == "Common Y-Axis" else None
+
+    kind = select_chart_kind()
+    if limits is not None:
+        st.info(limits_message(kind, limits))
+    slots = chart_slots(kind, available)
+
+    cache = get_chart_cache()
+    pending = {}
+    for (series, kind), placeholder in slots.items():
+        key = (series, kind, y_axis_type, data_version)
+        png = cache.get(key)
+        result = 'hit'
+        if png is None:
+            png = load_prebuilt_chart(data_version, series, kind, y_axis_type)
+            result = 'prebuilt' if png is not None else 'miss'
+            if png is not None:
+                cache.put(key, png)
+        metrics.count('chart_cache', result=result, kind=kind)
+        if png is not None:
+            placeholder.image(png)
+            continue
+        try:
+            ylim = limits[kind] if limits is not None else None
+            spec = chart_spec(series_frame(panel, series), series, kind, ylim)
+            pending[cache.submit(key, spec)] = (series, placeholder)
+        except Exception as e:
+            placeholder.error(f"Error loading {series_dict[series]}: {str(e)}")
+
+    for future in as_completed(pending):
+        series, placeholder = pending[future]
+        try:
+            placeholder.image(future.result())
+        except Exception as e:
+            placeholder.error(f"Error loading {series_dict[series]}: {str(e)}")
+
+# Define a function to plot all categories while their data is still arriving
+# Stored series are charted straight away and downloaded ones as each arrives.
+# Common Y-Axis charts start from the extrema of the series in hand and are
+# redrawn once all data is in, only if the final range differs; the finished
+# charts are cached under the app state's version, so the next run shows them
+# without rendering. Returns the app state
+@metrics.span('plot_progressive')
+def plot_progressive(y_axis_type):
+    started = time.perf_counter()
+    common = y_axis_type == "Common Y-Axis"
+    kind = select_chart_kind()
+    info = st.empty()
+    progress = st.empty()
+    slots = chart_slots(kind, set(all_series))
+
+    cache = get_chart_cache()
+    cache.warm_up()
+    deadline = fetch_engine.make_deadline()
+    frames, downloads = start_series_load(all_series, deadline)
+    limits = common_limits(build_panel(frames)) if common and frames else None
+    renders = {}  # Render future -> (series, ylim)
+    queued = []   # Series waiting for a free render worker
+    wanted = {}   # Series -> ylim of its latest render
+    drawn = {}    # Series -> (ylim, png) on screen
+
+    # Charts are only handed to the pool when a worker is free, so each is
+    # drawn with the range known at that moment rather than when it was queued
+    def render_queued():
+        while queued and len(renders) < charts.RENDER_WORKERS:
+            series = queued.pop(0)
+            ylim = limits[kind] if limits is not None else None
+            wanted[series] = ylim
+            data_df = frames[series]
+            key = (series, kind, y_axis_type, panel_version(data_df), ylim)
+            png = cache.get(key)
+            if png is not None:
+                show(series, ylim, png)
+                continue
+            future = cache.submit(key, chart_spec(data_df, series, kind, ylim))
+            renders[future] = (series, ylim)
+            pending.add(future)
+
+    # Show a chart unless a newer one for its series is on the way and it has one already
+    def show(series, ylim, png):
+        if series in drawn and ylim != wanted[series]:
+            return
+        if not drawn:
+            metrics.observe('time_to_first_chart', time.perf_counter() - started)
+        slots[(series, kind)].image(png)
+        drawn[series] = (ylim, png)
+
+    def show_progress():
+        loaded = len(all_series) - len(downloads)
+        if downloads:
+            progress.progress(loaded / len(all_series), text=f"Loaded {loaded} of {len(all_series)} series")
+        else:
+            progress.empty()
+        if limits is not None:
+            message = limits_message(kind, limits)
+            info.info(message + " (provisional until all series are loaded)" if downloads else message)
+
+    pending = set(downloads)
+    queued.extend(series for series in frames if (series, kind) in slots)
+    render_queued()
+    show_progress()
+
+    corrected = False
+    while pending or queued or not corrected:
+        if not downloads and not corrected:
+            # All data is in: redraw the charts drawn against a provisional range
+            corrected = True
+            ylim = limits[kind] if limits is not None else None
+            for series in list(wanted):
+                if wanted[series] != ylim and series not in queued:
+                    metrics.count('chart_correction', kind=kind)
+                    queued.append(series)
+            render_queued()
+            continue
+        timeout = max(0, deadline - time.monotonic()) if downloads else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Deadline exceeded; the series still downloading are left out
+            for future in list(downloads):
+                future.cancel()
+                pending.discard(future)
+                slots_warning(slots, downloads.pop(future), kind, "Deadline exceeded")
+            show_progress()
+            continue
+        for future in done:
+            if future in downloads:
+                series = downloads.pop(future)
+                try:
+                    all_data, missing = future.result()
+                except Exception as e:
+                    all_data, missing = {}, {series: str(e)}
+                if series in all_data:
+                    frames[series] = all_data[series]
+                    if common:
+                        limits = common_limits(build_panel(frames))
+                    if (series, kind) in slots:
+                        queued.append(series)
+                else:
+                    slots_warning(slots, series, kind, missing.get(series))
+                show_progress()
+            else:
+                series, ylim = renders.pop(future)
+                try:
+                    show(series, ylim, future.result())
+                except Exception as e:
+                    slots[(series, kind)].error(f"Error loading {series_dict[series]}: {str(e)}")
+        render_queued()
+
+    # The state is built from the frames in hand; series that failed or ran out
+    # of time stay missing rather than being downloaded again here
+    state = make_app_state(build_panel({series: frames[series] for series in all_series if series in frames}))
+    if not state['available']:
+        # Every download failed: there is nothing to keep, and the next run tries again
+        return state
+    get_load_state()['progressive'] = (time.time(), state)
+    final = state['limits'][kind] if common and state['limits'] is not None else None
+    for series, (ylim, png) in drawn.items():
+        if ylim == final:
+            cache.put((series, kind, y_axis_type, state['version']), png)
+    return state
+
+# Define a function to show that a series in the grid has no data
+def slots_warning(slots, series, kind, error):
+    if (series, kind) in slots:
+        slots[(series, kind)].warning(f"No data available for {series_dict[series]}: {error}")
+
+# Define a function to pick the chart type and title the chart grid
+# Only the selected chart type is built; st.tabs would run both bodies
+def select_chart_kind():
+    chart_type = st.radio(
+        "Chart type:",
+        list(CHART_TYPES),
+        horizontal=True,
+        key="chart_type"
+    )
+    kind = CHART_TYPES[chart_type]
+    if kind == VOLUME:
         st.markdown("### Volume Index Trends")
-        if y_axis_type == "Common Y-Axis":
-            st.info(f"📏 All charts use common Y-axis range: {volume_min:.0f} to {volume_max:.0f}")
-        # Use 2 columns layout for better readability
-        for i in range(0, len(all_series), 2):
-            cols = st.columns(2)
-            for j in range(2):
-                if i + j < len(all_series):
-                    series = all_series[i + j]
-                    if series in all_data:
-                        with cols[j]:
-                            try:
-                                data_df = all_data[series]
-                                series_description = series_dict[series]
-                                fig, ax = plt.subplots(figsize=(10, 5))
-                                ax.plot(data_df.index, data_df[f'{series}_volume_index'], 
-                                       label=f'{series_description}', linewidth=2.5, color='#1f77b4')
-                                ax.xaxis.set_major_locator(mdates.YearLocator())
-                                ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
-                                ax.set_title(f'{series_description}', fontsize=12, fontweight='bold')
-                                ax.set_xlabel('Year', fontsize=10)
-                                ax.set_ylabel('Index', fontsize=10)
-                                ax.legend(fontsize=9)
-                                plt.xticks(rotation=45, fontsize=9)
-                                plt.grid(True, color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
-                                
-                                # Set y-axis limits if common y-axis is selected
-                                if y_axis_type == "Common Y-Axis":
-                                    ax.set_ylim(volume_min, volume_max)
-                                
-                                plt.tight_layout()
-                                st.pyplot(fig)
-                            except Exception as e:
-                                st.error(f"Error loading {series_description}: {str(e)}")
-    
-    with tab2:
+    else:
         st.markdown("### Year-on-Year Percentage Change")
-        if y_axis_type == "Common Y-Axis":
-            st.info(f"📏 All charts use common Y-axis range: {yoy_min:.1f}% to {yoy_max:.1f}%")
-        # Use 2 columns layout for better readability
-        for i in range(0, len(all_series), 2):
-            cols = st.columns(2)
-            for j in range(2):
-                if i + j < len(all_series):
-                    series = all_series[i + j]
-                    if series in all_data:
-                        with cols[j]:
-                            try:
-                                data_df = all_data[series]
-                                series_description = series_dict[series]
-                                fig, ax = plt.subplots(figsize=(10, 5))
-                                ax.plot(data_df.index, data_df[f'{series}_volume_index_yoy'], 
-                                       label='YoY Change', linewidth=2.5, color='#ff7f0e')
-                                ax.axhline(y=0, color='black', linestyle='--', linewidth=1, alpha=0.3)
-                                ax.xaxis.set_major_locator(mdates.YearLocator())
-                                ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
-                                ax.set_title(f'{series_description} YoY', fontsize=12, fontweight='bold')
-                                ax.set_xlabel('Year', fontsize=10)
-                                ax.set_ylabel('Percentage Change (%)', fontsize=10)
-                                ax.legend(fontsize=9)
-                                plt.xticks(rotation=45, fontsize=9)
-                                plt.grid(True, color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
-                                
-                                # Set y-axis limits if common y-axis is selected
-                                if y_axis_type == "Common Y-Axis":
-                                    ax.set_ylim(yoy_min, yoy_max)
-                                
-                                plt.tight_layout()
-                                st.pyplot(fig)
-                            except Exception as e:
-                                st.error(f"Error loading {series_description}: {str(e)}")
+    return kind
+
+# Define a function to describe the common y-axis range of one chart type
+def limits_message(kind, limits):
+    low, high = limits[kind]
+    if kind == VOLUME:
+        return f"📏 All charts use common Y-axis range: {low:.0f} to {high:.0f}"
+    return f"📏 All charts use common Y-axis range: {low:.1f}% to {high:.1f}%"
+
+# Define a function to lay out the charts revealed so far, a page at a time
+# Returns a placeholder for each series with data, keyed by (series, kind)
+def chart_slots(kind, available):
+    shown = st.session_state.setdefault("charts_shown", CHARTS_PER_PAGE)
+    slots = plot_grid(kind, available, all_series[:shown])
+    if shown < len(all_series):
+        st.button(
+            f"Show more charts ({shown} of {len(all_series)} shown)",
+            on_click=show_more_charts
+        )
+    return slots
+
+# Define a cached function building the interactive page for one panel version
+@st.cache_data(max_entries=4)
+def interactive_page(_panel, data_version):
+    chart_list = [{'id': series, 'title': series_dict[series]} for series in panel_series(_panel)]
+    modes = [{'key': mode, 'name': name} for name, mode in Y_AXIS_MODES.items()]
+    return interactive.chart_html(interactive.chart_payload(_panel, chart_list, INTERACTIVE_KINDS, modes))
+
+# Define a function to embed a self-contained HTML page
+# st.iframe replaced st.components.v1.html, which older Streamlit releases still need
+def show_html(html, height):
+    if hasattr(st, 'iframe'):
+        st.iframe(html, height=height)
+    else:
+        import streamlit.components.v1 as components
+        components.html(html, height=height)
+
+# Define a function to plot all categories as interactive charts
+# The page is built once per panel version; switching chart type or y-axis
+# mode, zooming and panning all happen in the browser
+@metrics.span('plot_interactive')
+def plot_interactive(state=None):
+    state = state or get_app_state()
+    for series in state['missing']:
+        st.warning(f"No data available for {series_dict[series]}")
+    if not state['available']:
+        return
+    html = interactive_page(state['panel'], state['version'])
+    metrics.observe('interactive_page_bytes', len(html))
+    show_html(html, interactive.page_height(len(state['available'])))
+
+# Define a callback revealing the next page of charts
+def show_more_charts():
+    st.session_state["charts_shown"] += CHARTS_PER_PAGE
+
+# Define a function to lay out one kind of chart for the given series in a 2-column grid
+# Returns a placeholder for each series with data, keyed by (series, kind)
+def plot_grid(kind, available, series_list):
+    slots = {}
+    # Use 2 columns layout for better readability
+    for i in range(0, len(series_list), 2):
+        cols = st.columns(2)
+        for j in range(2):
+            if i + j < len(series_list):
+                series = series_list[i + j]
+                with cols[j]:
+                    if series not in available:
+                        st.warning(f"No data available for {series_dict[series]}")
+                        continue
+                    slots[(series, kind)] = st.empty()
+    return slots
+
+# Define a function to show the analytics of all series
+def show_analytics():
+    result = fetch_analytics()
+    if result.columns.empty:
+        st.warning("No data available for any series, so there are no analytics to show")
+        return
+    ranking, correlation = fetch_analytics_tables()
+
+    st.subheader("🏆 Latest Month Ranking")
+    st.caption("Ranked on year-on-year change; z-score compares it with the previous five years.")
+    ranking = ranking.rename(index=series_dict)
+    ranking['period'] = ranking['period'].dt.strftime('%Y-%m')
+    st.dataframe(ranking.style.format(precision=1), use_container_width=True)
+
+    st.subheader("📉 Trend and Seasonal Adjustment")
+    available = list(result['volume'].columns)
+    series = st.selectbox(
+        'Select a series', available, format_func=lambda s: f"{s}: {series_dict[s]}", key="analytics_series"
+    )
+    trends = result.xs(series, axis=1, level='series')
+    st.line_chart(trends[['volume', 'adjusted', 'trend', 'ma12']])
+
+    # A toggle rather than an expander, so the styled table is only built when opened
+    st.subheader("🔗 Correlation of Month-on-Month Changes")
+    if st.toggle(f"Show the last {analytics.CORRELATION_MONTHS} months", key="analytics_correlation"):
+        correlation = correlation.rename(index=series_dict)
+        st.dataframe(
+            correlation.style.background_gradient(cmap='RdBu', vmin=-1, vmax=1).format(precision=2),
+            use_container_width=True
+        )
+
+# Define a function to show the recorded timings and counters in the sidebar
+# Figures cover this process since it started, across all sessions
+def show_metrics_panel():
+    recorded = metrics.snapshot()
+    st.sidebar.markdown("### ⏱ Performance")
+    if recorded['spans']:
+        spans = pd.DataFrame(recorded['spans'])
+        for column in ('total', 'max', 'last'):
+            spans[column] = spans[column] * 1000
+        spans = spans.rename(columns={'total': 'total_ms', 'max': 'max_ms', 'last': 'last_ms'})
+        st.sidebar.dataframe(spans.sort_values('total_ms', ascending=False), hide_index=True)
+    if recorded['counters']:
+        st.sidebar.dataframe(pd.DataFrame(recorded['counters']), hide_index=True)
+    if recorded['values']:
+        st.sidebar.dataframe(pd.DataFrame(recorded['values']), hide_index=True)
 
 # Define the Streamlit app
 def main():
@@ -223,8 +964,9 @@ def main():
     # Add menu option for view type
     view_type = st.radio(
         "Choose view:",
-        ["Select Individual Category", "View All Categories"],
-        horizontal=True
+        ["Select Individual Category", "View All Categories", "Analytics"],
+        horizontal=True,
+        key="view_type"
     )
     
     st.divider()
@@ -236,31 +978,65 @@ def main():
 
         # Display the latest data points
         st.dataframe(data_df.tail())
+    elif view_type == "Analytics":
+        show_analytics()
     else:
-        # View all categories - add submenu for y-axis selection
+        # View all categories - add submenu for rendering and y-axis selection
         st.subheader("📊 Chart Display Options")
-        y_axis_option = st.radio(
-            "Select Y-axis scaling:",
-            ["Individual Y-Axis", "Common Y-Axis"],
+        render_mode = st.radio(
+            "Select chart rendering:",
+            list(RENDER_MODES),
             horizontal=True,
-            help="Individual Y-Axis scales each chart independently. Common Y-Axis uses the same scale for all charts to allow direct comparison."
+            key="render_mode",
+            help="Static Images are drawn on the server. Interactive charts are drawn in your browser, where chart type, y-axis scaling, zoom and pan change without reloading the page."
         )
-        
-        st.divider()
-        
-        # Draw charts based on selection
-        plot_definitions(y_axis_option)
+
+        state = ready_app_state()
+        if RENDER_MODES[render_mode] == "interactive":
+            st.divider()
+            state = state or get_app_state()
+            plot_interactive(state)
+        else:
+            y_axis_option = st.radio(
+                "Select Y-axis scaling:",
+                ["Individual Y-Axis", "Common Y-Axis"],
+                horizontal=True,
+                key="y_axis_type",
+                help="Individual Y-Axis scales each chart independently. Common Y-Axis uses the same scale for all charts to allow direct comparison."
+            )
+
+            st.divider()
+
+            # Draw charts based on selection, as their data arrives if some
+            # series are not stored yet
+            if state is None:
+                state = plot_progressive(y_axis_option)
+            else:
+                plot_definitions(y_axis_option, state)
         
         # Show latest data for each category in expanders
         st.subheader("📋 Latest Data")
+        panel = state['panel']
+        available = set(state['available'])
         for series in all_series:
-            try:
-                data_df = fetch_data(series)
-                series_description = series_dict[series]
-                with st.expander(f"🔍 {series_description}"):
-                    st.dataframe(data_df.tail(), use_container_width=True)
-            except Exception as e:
-                st.error(f"Error loading {series_dict[series]}: {str(e)}")
+            if series not in available:
+                st.error(f"Error loading {series_dict[series]}: no data returned")
+                continue
+            # A toggle rather than an expander, so the table is only built when opened
+            series_description = series_dict[series]
+            if st.toggle(f"🔍 {series_description}", key=f"latest_{series}"):
+                st.dataframe(latest_rows(panel, series), use_container_width=True)
+
+        # Offer every series as one compact file, built once per panel version
+        if state['available']:
+            release, data = snapshot_file(panel, state['version'])
+            st.download_button(
+                "📦 Download all series",
+                data,
+                file_name=f"hk-retail-sales-{release}.arrow",
+                mime=snapshot.ARROW_MIME,
+                help="Arrow IPC file with a YYYYMM period column and one float32 column per series and measure; series descriptions are in the schema metadata. Open it with pyarrow.ipc.open_file or pandas.read_feather."
+            )
 
     # Display attribution and caution
     st.markdown("""
@@ -274,6 +1050,10 @@ def main():
     for key, value in series_dict.items():
         st.sidebar.markdown(f"<small>{key} : {value}</small>", unsafe_allow_html=True)
 
+    # Optional timings and cache counters for debugging slow pages
+    if st.sidebar.toggle("⏱ Performance metrics", key="debug_metrics"):
+        show_metrics_panel()
+    metrics.write_metrics_file()
+
 if __name__ == "__main__":
     main()
-
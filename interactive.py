@@ -0,0 +1,361 @@
+# Interactive, browser-side charts for the all-categories dashboard
+# Ships every series once as compact base64 arrays (float32 values and
+# delta-encoded uint16 indices of an LTTB-downsampled grid view) inside a
+# self-contained HTML page; chart type, y-axis mode, zoom and pan are then
+# handled in the browser without a Streamlit rerun
+
+import base64
+import json
+
+import numpy as np
+
+GRID_POINTS = 160    # Points per small-multiple chart before zooming in
+CHART_HEIGHT = 220   # CSS pixels of each chart canvas
+ROW_HEIGHT = 272     # CSS pixels of a grid row: canvas, title, padding and gap
+TOOLBAR_HEIGHT = 56  # CSS pixels of the controls above the grid
+
+# Define a function to downsample a line to a number of points with
+# Largest-Triangle-Three-Buckets, which keeps the peaks and troughs a plain
+# stride would drop; returns the indices of the points to keep
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Pick the point forming the largest triangle with the previous pick
+        # and the average of the next bucket
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+# Define functions to pack arrays as base64 little-endian bytes for the browser
+def encode_floats(values):
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+def encode_indices(indices):
+    deltas = np.diff(np.asarray(indices, dtype=np.int64), prepend=0)
+    return base64.b64encode(deltas.astype('<u2').tobytes()).decode('ascii')
+
+# Define a function to build the browser payload for a monthly panel with
+# (measure, series) columns; charts lists {'id', 'title'} per series and kinds
+# lists {'key', 'name', 'suffix', 'unit', 'color', 'zero_line'} per measure
+def chart_payload(panel, charts, kinds, modes):
+    first = panel.index[0] if len(panel) else None
+    payload = {
+        'start': first.year * 12 + first.month - 1 if first is not None else 0,
+        'length': len(panel),
+        'kinds': kinds,
+        'modes': modes,
+        'charts': []
+    }
+    for chart in charts:
+        entry = dict(chart)
+        for kind in kinds:
+            y = panel[(kind['key'], chart['id'])].to_numpy(dtype='float64')
+            finite = np.flatnonzero(np.isfinite(y))
+            grid = finite[lttb(finite.astype('float64'), y[finite], GRID_POINTS)] if len(finite) else finite
+            entry[kind['key']] = {'values': encode_floats(y), 'grid': encode_indices(grid)}
+        payload['charts'].append(entry)
+    return payload
+
+# Define a function to work out the height of the page for a number of charts
+def page_height(chart_count):
+    return TOOLBAR_HEIGHT + (chart_count + 1) // 2 * ROW_HEIGHT
+
+# Define a function to render the payload into a self-contained HTML page
+def chart_html(payload):
+    # Escape "</" so the JSON cannot close the script element early
+    data = json.dumps(payload, separators=(',', ':')).replace('</', '<\\/')
+    return TEMPLATE.replace('__CHART_HEIGHT__', str(CHART_HEIGHT)).replace('__PAYLOAD__', data)
+
+TEMPLATE = """<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+  body { margin: 0; font-family: "Source Sans Pro", sans-serif; color: #31333f; }
+  .bar { display: flex; gap: 12px; align-items: center; flex-wrap: wrap; height: 44px; }
+  .bar button { border: 1px solid #d6d6d9; background: #fff; border-radius: 6px;
+                padding: 4px 10px; cursor: pointer; font: inherit; font-size: 14px; }
+  .bar button.on { border-color: #ff4b4b; color: #ff4b4b; }
+  .hint { color: #808495; font-size: 13px; }
+  .grid { display: grid; grid-template-columns: 1fr 1fr; gap: 12px; }
+  .card { border: 1px solid #e6e6ea; border-radius: 6px; padding: 6px 8px; }
+  .card h4 { margin: 0 0 4px; font-size: 14px; white-space: nowrap; overflow: hidden;
+             text-overflow: ellipsis; }
+  .card .value { float: right; font-weight: normal; color: #808495; }
+  canvas { width: 100%; height: __CHART_HEIGHT__px; display: block; cursor: crosshair; }
+</style>
+</head>
+<body>
+<div class="bar">
+  <span id="kinds"></span>
+  <span id="modes"></span>
+  <button id="reset">Reset zoom</button>
+  <span class="hint">Drag to zoom into a period, Shift+drag to pan, Ctrl+scroll to zoom, double-click to reset</span>
+</div>
+<div class="grid" id="grid"></div>
+<script>
+const DATA = __PAYLOAD__;
+const N = DATA.length;
+const state = { kind: DATA.kinds[0].key, mode: DATA.modes[0].key, x0: 0, x1: Math.max(N - 1, 1) };
+
+function decode(text, Type) {
+  const bin = atob(text);
+  const bytes = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  return new Type(bytes.buffer);
+}
+
+function undelta(deltas) {
+  const out = new Uint32Array(deltas.length);
+  let acc = 0;
+  for (let i = 0; i < deltas.length; i++) { acc += deltas[i]; out[i] = acc; }
+  return out;
+}
+
+for (const chart of DATA.charts) {
+  for (const kind of DATA.kinds) {
+    const m = chart[kind.key];
+    m.y = decode(m.values, Float32Array);
+    m.grid = undelta(decode(m.grid, Uint16Array));
+  }
+}
+
+function kindInfo() { return DATA.kinds.find(k => k.key === state.kind); }
+function zoomed() { return state.x0 > 0 || state.x1 < N - 1; }
+
+// The downsampled grid view when zoomed out, every point in view when zoomed in
+function visible(m) {
+  if (!zoomed()) return m.grid;
+  const lo = Math.max(0, Math.floor(state.x0) - 1), hi = Math.min(N - 1, Math.ceil(state.x1) + 1);
+  const out = new Uint32Array(hi - lo + 1);
+  for (let i = lo; i <= hi; i++) out[i - lo] = i;
+  return out;
+}
+
+function extent(m, idx) {
+  let lo = Infinity, hi = -Infinity;
+  for (const i of idx) {
+    if (i < state.x0 - 1 || i > state.x1 + 1) continue;
+    const v = m.y[i];
+    if (Number.isFinite(v)) { if (v < lo) lo = v; if (v > hi) hi = v; }
+  }
+  return [lo, hi];
+}
+
+// Same padding as the server's common y-axis: 10% of each limit, away from zero
+let commonCache = null;
+function commonRange() {
+  const key = state.kind + ':' + state.x0 + ':' + state.x1;
+  if (commonCache && commonCache.key === key) return commonCache.range;
+  let lo = Infinity, hi = -Infinity;
+  for (const chart of DATA.charts) {
+    const m = chart[state.kind];
+    const [a, b] = extent(m, zoomed() ? visible(m) : m.y.keys());
+    lo = Math.min(lo, a); hi = Math.max(hi, b);
+  }
+  const range = [lo - Math.abs(lo) * 0.1, hi + Math.abs(hi) * 0.1];
+  commonCache = { key, range };
+  return range;
+}
+
+function ticks(lo, hi, count) {
+  const raw = (hi - lo) / count, mag = Math.pow(10, Math.floor(Math.log10(raw)));
+  const step = [1, 2, 2.5, 5, 10].map(s => s * mag).find(s => s >= raw);
+  const out = [];
+  for (let v = Math.ceil(lo / step) * step; v <= hi + step * 1e-9; v += step) out.push(v);
+  return out;
+}
+
+function label(v, unit) {
+  const digits = Math.abs(v) >= 100 || v === 0 ? 0 : 1;
+  return v.toFixed(digits) + unit;
+}
+
+function period(i) {
+  const abs = DATA.start + i;
+  return Math.floor(abs / 12) + '-' + String(abs % 12 + 1).padStart(2, '0');
+}
+
+const PAD = { left: 48, right: 8, top: 6, bottom: 22 };
+
+function draw(card) {
+  card.stale = false;
+  const c = card.canvas, dpr = window.devicePixelRatio || 1;
+  const w = c.clientWidth, h = c.clientHeight;
+  if (c.width !== Math.round(w * dpr)) { c.width = Math.round(w * dpr); c.height = Math.round(h * dpr); }
+  const g = c.getContext('2d');
+  g.setTransform(dpr, 0, 0, dpr, 0, 0);
+  g.clearRect(0, 0, w, h);
+  const kind = kindInfo(), m = card.chart[state.kind], idx = visible(m);
+  card.title.textContent = card.chart.title + kind.suffix;
+
+  let [lo, hi] = state.mode === 'common' ? commonRange() : extent(m, idx);
+  if (!Number.isFinite(lo)) {
+    g.fillStyle = '#808495'; g.font = '13px sans-serif'; g.textAlign = 'center';
+    g.fillText('No data in this period', w / 2, h / 2);
+    return;
+  }
+  if (state.mode !== 'common') { const margin = (hi - lo) * 0.05 || 1; lo -= margin; hi += margin; }
+  const pw = w - PAD.left - PAD.right, ph = h - PAD.top - PAD.bottom;
+  const sx = i => PAD.left + (i - state.x0) / (state.x1 - state.x0) * pw;
+  const sy = v => PAD.top + (hi - v) / (hi - lo) * ph;
+  card.scale = { sx, pw };
+
+  g.font = '11px sans-serif'; g.fillStyle = '#808495';
+  g.strokeStyle = 'rgba(128, 128, 128, 0.25)'; g.lineWidth = 1;
+  g.textAlign = 'right'; g.textBaseline = 'middle';
+  for (const v of ticks(lo, hi, 5)) {
+    const y = Math.round(sy(v)) + 0.5;
+    g.beginPath(); g.moveTo(PAD.left, y); g.lineTo(PAD.left + pw, y); g.stroke();
+    g.fillText(label(v, kind.unit), PAD.left - 4, y);
+  }
+  const years = (state.x1 - state.x0) / 12;
+  const step = [1, 2, 5, 10, 20].find(s => years / s <= pw / 45) || 50;
+  g.textAlign = 'center'; g.textBaseline = 'top';
+  for (let year = Math.ceil((DATA.start + state.x0) / 12); year * 12 - DATA.start <= state.x1; year++) {
+    if (year % step) continue;
+    const x = Math.round(sx(year * 12 - DATA.start)) + 0.5;
+    g.beginPath(); g.moveTo(x, PAD.top); g.lineTo(x, PAD.top + ph); g.stroke();
+    g.fillText(String(year), x, PAD.top + ph + 4);
+  }
+
+  g.save();
+  g.beginPath(); g.rect(PAD.left, PAD.top, pw, ph); g.clip();
+  if (kind.zero_line && lo < 0 && hi > 0) {
+    g.strokeStyle = 'rgba(0, 0, 0, 0.3)'; g.setLineDash([4, 4]);
+    g.beginPath(); g.moveTo(PAD.left, sy(0)); g.lineTo(PAD.left + pw, sy(0)); g.stroke();
+    g.setLineDash([]);
+  }
+  g.strokeStyle = kind.color; g.lineWidth = 1.75; g.lineJoin = 'round';
+  g.beginPath();
+  let pen = false;
+  for (const i of idx) {
+    const v = m.y[i];
+    if (!Number.isFinite(v)) { pen = false; continue; }
+    if (pen) g.lineTo(sx(i), sy(v)); else g.moveTo(sx(i), sy(v));
+    pen = true;
+  }
+  g.stroke();
+  if (card.drag && card.drag.select) {
+    const a = Math.min(card.drag.from, card.drag.to), b = Math.max(card.drag.from, card.drag.to);
+    g.fillStyle = 'rgba(255, 75, 75, 0.12)';
+    g.fillRect(a, PAD.top, b - a, ph);
+  }
+  g.restore();
+}
+
+// Only charts scrolled into view are drawn; the rest are drawn when they appear
+const cards = [];
+let frame = null;
+function redraw(all) {
+  if (all) { commonCache = null; for (const card of cards) card.stale = true; }
+  if (frame) return;
+  frame = requestAnimationFrame(() => {
+    frame = null;
+    for (const card of cards) if (card.stale && card.visible) draw(card);
+  });
+}
+
+function setView(x0, x1) {
+  const span = Math.min(Math.max(x1 - x0, 12), N - 1);
+  x0 = Math.max(0, Math.min(x0, N - 1 - span));
+  state.x0 = x0; state.x1 = x0 + span;
+  redraw(true);
+}
+
+function index(card, px) {
+  const pw = card.scale ? card.scale.pw : 1;
+  return state.x0 + (px - PAD.left) / pw * (state.x1 - state.x0);
+}
+
+function showValue(card, px) {
+  const i = Math.round(index(card, px));
+  const m = card.chart[state.kind];
+  const v = i >= 0 && i < N ? m.y[i] : NaN;
+  card.value.textContent = Number.isFinite(v) ? period(i) + ': ' + v.toFixed(1) + kindInfo().unit : '';
+}
+
+const observer = new IntersectionObserver(entries => {
+  for (const entry of entries) entry.target.card.visible = entry.isIntersecting;
+  redraw(false);
+});
+
+const grid = document.getElementById('grid');
+for (const chart of DATA.charts) {
+  const el = document.createElement('div');
+  el.className = 'card';
+  el.innerHTML = '<h4><span class="value"></span><span class="title"></span></h4><canvas></canvas>';
+  const card = { chart, el, canvas: el.querySelector('canvas'), title: el.querySelector('.title'),
+                 value: el.querySelector('.value'), stale: true, visible: false, drag: null };
+  el.card = card;
+  cards.push(card);
+  grid.appendChild(el);
+  observer.observe(el);
+
+  const c = card.canvas;
+  c.addEventListener('mousedown', e => {
+    card.drag = { from: e.offsetX, to: e.offsetX, select: !e.shiftKey, x0: state.x0, x1: state.x1 };
+  });
+  c.addEventListener('mousemove', e => {
+    showValue(card, e.offsetX);
+    if (!card.drag) return;
+    card.drag.to = e.offsetX;
+    if (card.drag.select) { card.stale = true; redraw(false); return; }
+    const shift = (card.drag.from - e.offsetX) / card.scale.pw * (card.drag.x1 - card.drag.x0);
+    setView(card.drag.x0 + shift, card.drag.x1 + shift);
+  });
+  c.addEventListener('mouseup', e => {
+    const drag = card.drag;
+    card.drag = null;
+    if (drag && drag.select && Math.abs(drag.to - drag.from) > 4) {
+      const a = index(card, Math.min(drag.from, drag.to)), b = index(card, Math.max(drag.from, drag.to));
+      setView(a, b);
+    } else {
+      card.stale = true; redraw(false);
+    }
+  });
+  c.addEventListener('mouseleave', () => { card.value.textContent = ''; card.drag = null; card.stale = true; redraw(false); });
+  c.addEventListener('dblclick', () => setView(0, N - 1));
+  c.addEventListener('wheel', e => {
+    if (!e.ctrlKey) return;  // Plain scrolling keeps scrolling the page
+    e.preventDefault();
+    const at = index(card, e.offsetX), factor = e.deltaY > 0 ? 1.25 : 0.8;
+    setView(at - (at - state.x0) * factor, at + (state.x1 - at) * factor);
+  }, { passive: false });
+}
+
+function buttons(id, items, key) {
+  const box = document.getElementById(id);
+  for (const item of items) {
+    const b = document.createElement('button');
+    b.textContent = item.name;
+    b.onclick = () => {
+      state[key] = item.key;
+      for (const other of box.children) other.classList.toggle('on', other === b);
+      redraw(true);
+    };
+    b.classList.toggle('on', state[key] === item.key);
+    box.appendChild(b);
+  }
+}
+buttons('kinds', DATA.kinds, 'kind');
+buttons('modes', DATA.modes, 'mode');
+document.getElementById('reset').onclick = () => setView(0, N - 1);
+window.addEventListener('resize', () => redraw(true));
+</script>
+</body>
+</html>
+"""
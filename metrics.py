@@ -0,0 +1,124 @@
+# Lightweight in-process instrumentation
+# Records span timings, counters and observed values (such as payload sizes)
+# with optional labels, logs every span as a JSON line and renders everything
+# in the Prometheus text format so it can be scraped
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("hk_retail.metrics")
+
+METRICS_FILE = os.environ.get("HK_RETAIL_METRICS_FILE")  # Prometheus textfile output, if set
+
+_lock = threading.Lock()
+_spans = {}      # (name, labels) -> {'count', 'total', 'max', 'last'}
+_counters = {}   # (name, labels) -> value
+_values = {}     # (name, labels) -> {'count', 'total', 'max', 'last'}
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _record(store, name, labels, value):
+    key = _key(name, labels)
+    with _lock:
+        stats = store.get(key)
+        if stats is None:
+            stats = store[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+        stats['count'] += 1
+        stats['total'] += value
+        stats['max'] = max(stats['max'], value)
+        stats['last'] = value
+
+# Define a context manager timing a block of code as a named span
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _record(_spans, name, labels, seconds)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'span': name, 'seconds': round(seconds, 6), 'error': error, **labels
+            }, default=str))
+
+# Define a function to increase a named counter
+def count(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+# Define a function to record an observed value such as a payload size
+def observe(name, value, **labels):
+    _record(_values, name, labels, value)
+
+# Define a function to clear everything recorded so far
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _values.clear()
+
+# Define a function to return everything recorded as plain rows, for tables and tests
+def snapshot():
+    with _lock:
+        spans = [dict(name=n, **dict(l), **s) for (n, l), s in _spans.items()]
+        counters = [dict(name=n, **dict(l), value=v) for (n, l), v in _counters.items()]
+        values = [dict(name=n, **dict(l), **s) for (n, l), s in _values.items()]
+    return {'spans': spans, 'counters': counters, 'values': values}
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+# Define a function to render everything in the Prometheus text exposition format
+def prometheus_text(prefix="hk_retail"):
+    lines = []
+    with _lock:
+        for (name, labels), stats in sorted(_spans.items()):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"{metric}_count{_labels_text(labels)} {stats['count']}")
+            lines.append(f"{metric}_sum{_labels_text(labels)} {stats['total']:.6f}")
+            lines.append(f"{metric}_max{_labels_text(labels)} {stats['max']:.6f}")
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{prefix}_{name}_total{_labels_text(labels)} {value}")
+        for (name, labels), stats in sorted(_values.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"{metric}_count{_labels_text(labels)} {stats['count']}")
+            lines.append(f"{metric}_sum{_labels_text(labels)} {stats['total']}")
+            lines.append(f"{metric}_max{_labels_text(labels)} {stats['max']}")
+    return "\n".join(lines) + "\n"
+
+# Define a function to write the Prometheus text to METRICS_FILE, if configured
+# Writes to a temporary file of its own first, so a scraper never reads a
+# partial file and concurrent reruns in one process do not share one; a failed
+# write is logged rather than raised, as metrics must never break a page
+def write_metrics_file(path=None):
+    path = path or METRICS_FILE
+    if not path:
+        return False
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.warning("Could not write metrics to %s", path, exc_info=True)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
@@ -0,0 +1,252 @@
+# Declarative query layer over the censtatd API
+# A query names a table, cv filters, sv measures with their statistic, a period
+# range and a frequency. Queries are broken into chunks of one dimension code
+# combination, measure and year; chunks fetched recently are served from
+# memory, chunks another thread is already fetching are waited for, and the
+# rest are merged into the fewest POSTs that cover them. Every query comes back
+# as one frame on a regular period index, so queries over the same tables can
+# be lined up column by column
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, wait
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+import api_periods
+import fetch_engine
+import metrics
+
+MEMO_TTL = 3600          # Seconds a fetched chunk is served before it is fetched again
+MEMO_ENTRIES = 100000    # Chunks kept in memory, least recently used dropped first
+MAX_CODES_PER_POST = 24  # Codes of the first dimension asked for in one request
+
+# Define the supported frequencies and the pandas frequency of their index
+FREQUENCIES = {'M': 'MS', 'Y': 'YS'}
+
+# Define a query: filters as ((dimension, codes), ...), measures as
+# ((sv code, statistic), ...), an inclusive period range and a frequency
+Query = namedtuple('Query', ['table_id', 'cv', 'sv', 'start', 'end', 'freq'])
+
+# Define the unit results are memoized in: one code per dimension, one
+# measure and statistic, one year
+Chunk = namedtuple('Chunk', ['table_id', 'dims', 'codes', 'sv', 'stat', 'freq', 'year'])
+
+_memo = OrderedDict()  # Chunk -> (fetched_at, periods, figures)
+_pending = {}          # Chunk -> Future of the request fetching it
+_lock = threading.Lock()
+
+# Define a function to build the API parameters of one request
+def build_parameters(table_id, cv, sv, start, end=None):
+    period = {"start": start}
+    if end is not None:
+        period["end"] = end
+    return {
+        "cv": {dimension: list(codes) for dimension, codes in cv.items()},
+        "sv": {code: list(stats) for code, stats in sv.items()},
+        "period": period,
+        "id": table_id,
+        "lang": "en"
+    }
+
+# Define a function to build a normalized query from API-style cv and sv dicts
+# Queries asking for the same thing in a different order come out equal
+def make_query(table_id, cv, sv, start, end=None, freq='M'):
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Unsupported frequency {freq!r}")
+    cv = tuple(sorted((dimension, tuple(sorted({str(code) for code in codes}))) for dimension, codes in cv.items()))
+    sv = tuple(sorted({(code, stat) for code, stats in sv.items() for stat in stats}))
+    return Query(table_id, cv, sv, str(start), None if end is None else str(end), freq)
+
+# Define functions to give the first and last period of a year in the API's format
+def year_start(year, freq):
+    return f"{year}01" if freq == 'M' else str(year)
+
+def year_end(year, freq):
+    return f"{year}12" if freq == 'M' else str(year)
+
+# Define a function to list the years a query covers; open-ended queries run to this year
+def query_years(query):
+    last = int(query.end[:4]) if query.end is not None else time.localtime().tm_year
+    return range(int(query.start[:4]), last + 1)
+
+# Define a function to list every chunk a query needs
+def query_chunks(query):
+    dims = tuple(dimension for dimension, _ in query.cv)
+    return [
+        Chunk(query.table_id, dims, codes, sv_code, stat, query.freq, year)
+        for codes in product(*(codes for _, codes in query.cv))
+        for sv_code, stat in query.sv
+        for year in query_years(query)
+    ]
+
+# Define a function to plan the requests fetching a set of chunks
+# Chunks of the same table, dimensions, statistic and frequency share requests,
+# which ask for whole years so every chunk they touch is complete; a request
+# covers every chunk in its range, and all of those are memoized
+def plan_requests(chunks):
+    groups = {}
+    for chunk in chunks:
+        group = groups.setdefault(
+            (chunk.table_id, chunk.dims, chunk.stat, chunk.freq),
+            {'codes': [set() for _ in chunk.dims], 'sv': set(), 'years': set()}
+        )
+        for codes, code in zip(group['codes'], chunk.codes):
+            codes.add(code)
+        group['sv'].add(chunk.sv)
+        group['years'].add(chunk.year)
+
+    plans = []
+    for (table_id, dims, stat, freq), group in groups.items():
+        sv_codes = sorted(group['sv'])
+        years = range(min(group['years']), max(group['years']) + 1)
+        first_codes = sorted(group['codes'][0])
+        for i in range(0, len(first_codes), MAX_CODES_PER_POST):
+            codes = [first_codes[i:i + MAX_CODES_PER_POST]] + [sorted(c) for c in group['codes'][1:]]
+            plans.append({
+                'parameters': build_parameters(
+                    table_id, dict(zip(dims, codes)), {sv_code: [stat] for sv_code in sv_codes},
+                    year_start(years[0], freq), year_end(years[-1], freq)
+                ),
+                'chunks': [
+                    Chunk(table_id, dims, combination, sv_code, stat, freq, year)
+                    for combination in product(*codes) for sv_code in sv_codes for year in years
+                ]
+            })
+    return plans
+
+# Define a function to send one planned request and split the rows into its chunks
+# Chunks without rows come back empty, so they are not asked for again
+def fetch_plan(plan, deadline=None):
+    with metrics.span('query_post'):
+        response_data = fetch_engine.post_query(plan['parameters'], deadline)
+    first = plan['chunks'][0]
+    wanted = set(plan['chunks'])
+    keys, periods, figures = [], [], []
+    for row in response_data['dataSet']:
+        if row.get('freq') != first.freq:
+            continue
+        chunk = first._replace(
+            codes=tuple(row.get(dimension) for dimension in first.dims),
+            sv=row.get('sv'),
+            year=int(row['period'][:4])
+        )
+        if chunk in wanted:  # Skips totals and anything else not asked for
+            keys.append(chunk)
+            periods.append(int(row['period']))
+            figures.append(row['figure'])
+    periods = np.array(periods, dtype=np.int64)
+    figures = pd.to_numeric(pd.Series(figures, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    rows = {chunk: [] for chunk in plan['chunks']}
+    for i, chunk in enumerate(keys):
+        rows[chunk].append(i)
+    result = {}
+    for chunk, positions in rows.items():
+        order = np.array(positions, dtype=np.int64)
+        order = order[np.argsort(periods[order], kind='stable')]
+        result[chunk] = (periods[order], figures[order])
+    return result
+
+# Define a function to assemble a query's frame from memoized chunks
+# Columns are (sv code, statistic, code per dimension); the index covers every
+# period between the first and last figure at the query's frequency
+def assemble(query, memo):
+    dims = tuple(dimension for dimension, _ in query.cv)
+    low = int(query.start)
+    high = int(query.end) if query.end is not None else np.iinfo(np.int64).max
+    columns = {}
+    for codes in product(*(codes for _, codes in query.cv)):
+        for sv_code, stat in query.sv:
+            parts = [
+                memo[Chunk(query.table_id, dims, codes, sv_code, stat, query.freq, year)]
+                for year in query_years(query)
+            ]
+            periods = np.concatenate([part[1] for part in parts])
+            figures = np.concatenate([part[2] for part in parts])
+            keep = (periods >= low) & (periods <= high)
+            columns[(sv_code, stat) + codes] = pd.Series(
+                figures[keep], index=api_periods.period_index(periods[keep], query.freq), dtype='float64'
+            )
+    frame = pd.DataFrame(columns)
+    if columns:
+        frame.columns.names = ['sv', 'statistic', *dims]
+    frame = frame.sort_index()
+    if len(frame):
+        frame = frame.asfreq(FREQUENCIES[query.freq])
+    frame.index.name = 'period'
+    return frame
+
+# Define a function to run several queries, sharing chunks and requests between them
+# Returns one frame per query, in order; raises if a needed request failed
+def run_queries(queries, deadline=None):
+    if deadline is None:
+        deadline = fetch_engine.make_deadline()
+    needed = list(dict.fromkeys(chunk for query in queries for chunk in query_chunks(query)))
+    now = time.time()
+    waiting = set()
+    with _lock:
+        missing = []
+        for chunk in needed:
+            entry = _memo.get(chunk)
+            if entry is not None and now - entry[0] < MEMO_TTL:
+                _memo.move_to_end(chunk)
+            elif chunk in _pending:
+                waiting.add(_pending[chunk])
+            else:
+                missing.append(chunk)
+        plans = plan_requests(missing)
+        futures = []
+        for plan in plans:
+            future = Future()
+            for chunk in plan['chunks']:
+                _pending.setdefault(chunk, future)
+            futures.append(future)
+    metrics.count('query_chunks', len(needed) - len(missing), result='hit')
+    metrics.count('query_chunks', len(missing), result='fetch')
+
+    if plans:
+        results, errors = fetch_engine.fetch_many(
+            lambda i, deadline: fetch_plan(plans[i], deadline), range(len(plans)), deadline=deadline
+        )
+        fetched_at = time.time()
+        with _lock:
+            for i, (plan, future) in enumerate(zip(plans, futures)):
+                for chunk in plan['chunks']:
+                    if _pending.get(chunk) is future:
+                        del _pending[chunk]
+                if i in results:
+                    for chunk, (periods, figures) in results[i].items():
+                        _memo[chunk] = (fetched_at, periods, figures)
+                        _memo.move_to_end(chunk)
+            while len(_memo) > MEMO_ENTRIES:
+                _memo.popitem(last=False)
+        for i, future in enumerate(futures):
+            if i in results:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError(errors[i]))
+
+    # Chunks other threads were fetching; their errors are ours too
+    if waiting:
+        done, not_done = wait(waiting, timeout=max(0, deadline - time.monotonic()))
+        if not_done:
+            raise TimeoutError("Deadline exceeded while waiting for a shared request")
+        for future in done:
+            future.result()
+    if plans and len(results) < len(plans):
+        raise RuntimeError(f"Query request failed: {next(iter(errors.values()))}")
+
+    with _lock:
+        return [assemble(query, _memo) for query in queries]
+
+# Define a function to run a single query
+def run_query(query, deadline=None):
+    return run_queries([query], deadline)[0]
+
+# Define a function to forget every memoized chunk
+def clear():
+    with _lock:
+        _memo.clear()
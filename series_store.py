@@ -0,0 +1,318 @@
+# Persistent on-disk store for series data
+# Keeps one row per (table id, OUTLET_TYPE, sv code, period) in SQLite, with the
+# figure and its YoY change, so a restarted or freshly deployed process can
+# serve data without the API. Every process pointed at the same file shares it,
+# and short leases make sure only one of them refreshes a series at a time
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import api_periods
+
+STORE_PATH = os.environ.get(
+    "HK_RETAIL_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "series.sqlite")
+)
+MAX_AGE = 3600  # Seconds before a stored series is refreshed in the background
+LEASE_SECONDS = 60  # Seconds a refresh may hold a series before others take over
+LEASE_POLL = 0.2    # Seconds between checks while waiting for another refresh
+
+logger = logging.getLogger(__name__)
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+SCHEMA_VERSION = 2  # Bump to discard stores written with an older layout
+
+# Define a function to open the store, creating the schema on first use
+def connect(path=None):
+    path = path or STORE_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # The store is only a cache, so an outdated layout is simply rebuilt.
+        # Processes opening a new store together would drop each other's
+        # tables, so the version is checked again under the write lock
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS series_meta")
+            conn.execute("DROP TABLE IF EXISTS series_data")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS series_meta (
+            table_id TEXT NOT NULL,
+            outlet_type TEXT NOT NULL,
+            sv_code TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            latest_period TEXT,
+            PRIMARY KEY (table_id, outlet_type, sv_code)
+        );
+        CREATE TABLE IF NOT EXISTS series_data (
+            table_id TEXT NOT NULL,
+            outlet_type TEXT NOT NULL,
+            sv_code TEXT NOT NULL,
+            period TEXT NOT NULL,
+            figure REAL,
+            yoy REAL,
+            PRIMARY KEY (table_id, outlet_type, sv_code, period)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS series_lease (
+            table_id TEXT NOT NULL,
+            outlet_type TEXT NOT NULL,
+            sv_code TEXT NOT NULL,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (table_id, outlet_type, sv_code)
+        );
+    """)
+    return conn
+
+# Define a context manager that commits on success and always closes the connection
+@contextmanager
+def open_store(path=None):
+    conn = connect(path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+# Define a function to read a stored series
+# Returns (frame with 'figure' and 'yoy' columns indexed by period, metadata dict)
+# or None if nothing is stored
+def load_series(table_id, outlet_type, sv_code, path=None):
+    key = (table_id, outlet_type, sv_code)
+    try:
+        return _read_series(key, path)
+    except (sqlite3.Error, OSError):
+        logger.warning("Could not read %s from the store", key, exc_info=True)
+        return None
+
+def _read_series(key, path):
+    with open_store(path) as conn:
+        meta = conn.execute(
+            "SELECT fetched_at, latest_period FROM series_meta "
+            "WHERE table_id = ? AND outlet_type = ? AND sv_code = ?", key
+        ).fetchone()
+        if meta is None:
+            return None
+        rows = conn.execute(
+            "SELECT period, figure, yoy FROM series_data "
+            "WHERE table_id = ? AND outlet_type = ? AND sv_code = ? ORDER BY period", key
+        ).fetchall()
+    periods = pd.to_datetime([row[0] for row in rows], format='%Y%m')
+    frame = pd.DataFrame(
+        [row[1:] for row in rows], index=periods, columns=['figure', 'yoy'], dtype='float64'
+    )
+    frame.index.name = 'period'
+    return frame, {'fetched_at': meta[0], 'latest_period': meta[1]}
+
+# Define a function to read every series stored for a table and sv code, or
+# only those with the given OUTLET_TYPE codes
+# Returns {OUTLET_TYPE: (frame, metadata dict)} as load_series gives them, from
+# one query over all series; empty if the store cannot be read
+def load_all_series(table_id, sv_code, outlet_types=None, path=None):
+    try:
+        return _read_all_series(table_id, sv_code, outlet_types, path)
+    except (sqlite3.Error, OSError):
+        logger.warning("Could not read the series stored for %s", table_id, exc_info=True)
+        return {}
+
+def _read_all_series(table_id, sv_code, outlet_types, path):
+    where = "WHERE table_id = ? AND sv_code = ?"
+    params = (table_id, sv_code)
+    if outlet_types is not None:
+        where += f" AND outlet_type IN ({', '.join('?' * len(outlet_types))})"
+        params += tuple(outlet_types)
+    with open_store(path) as conn:
+        # One read transaction, so the metadata and figures are the same snapshot
+        conn.execute("BEGIN")
+        metas = conn.execute(
+            f"SELECT outlet_type, fetched_at, latest_period FROM series_meta {where}", params
+        ).fetchall()
+        rows = conn.execute(
+            f"SELECT outlet_type, CAST(period AS INTEGER), figure, yoy FROM series_data {where}", params
+        ).fetchall()
+    outlets = np.array([row[0] for row in rows], dtype=str)
+    periods = np.array([row[1] for row in rows], dtype=np.int64)
+    values = np.column_stack([
+        np.array([row[2] for row in rows], dtype='float64'),
+        np.array([row[3] for row in rows], dtype='float64')
+    ])
+
+    # Sort by series then period, so every series is one contiguous block
+    order = np.lexsort((periods, outlets))
+    outlets, periods, values = outlets[order], periods[order], values[order]
+    index = api_periods.period_index(periods, 'M')
+    starts = np.flatnonzero(np.r_[len(outlets) > 0, outlets[1:] != outlets[:-1]])
+    blocks = {outlets[start]: slice(start, end) for start, end in zip(starts, np.r_[starts[1:], len(outlets)])}
+
+    result = {}
+    for outlet_type, fetched_at, latest_period in metas:
+        block = blocks.get(outlet_type, slice(0, 0))
+        frame = pd.DataFrame(values[block], index=index[block], columns=['figure', 'yoy'])
+        result[outlet_type] = (frame, {'fetched_at': fetched_at, 'latest_period': latest_period})
+    return result
+
+# Define a function to list the OUTLET_TYPE codes stored for a table and sv code
+# Returns an empty list if the store cannot be read
+def list_series(table_id, sv_code, path=None):
+    try:
+        with open_store(path) as conn:
+            rows = conn.execute(
+                "SELECT outlet_type FROM series_meta WHERE table_id = ? AND sv_code = ?",
+                (table_id, sv_code)
+            ).fetchall()
+    except (sqlite3.Error, OSError):
+        logger.warning("Could not list the series stored for %s", table_id, exc_info=True)
+        return []
+    return [row[0] for row in rows]
+
+# Define a function to replace a stored series with a freshly fetched frame
+# Returns False if the store could not be written, e.g. on a read-only disk
+def save_series(table_id, outlet_type, sv_code, frame, fetched_at=None, path=None):
+    return _write(table_id, outlet_type, sv_code, frame, fetched_at, path, replace=True)
+
+# Define a function to upsert the given rows into a stored series
+# Rows for periods already stored are overwritten, others are added
+def merge_series(table_id, outlet_type, sv_code, frame, fetched_at=None, path=None):
+    return _write(table_id, outlet_type, sv_code, frame, fetched_at, path, replace=False)
+
+def _write(table_id, outlet_type, sv_code, frame, fetched_at, path, replace):
+    key = (table_id, outlet_type, sv_code)
+    try:
+        _write_series(key, frame, fetched_at or time.time(), path, replace)
+    except (sqlite3.Error, OSError):
+        logger.warning("Could not write %s to the store", key, exc_info=True)
+        return False
+    return True
+
+def _write_series(key, frame, fetched_at, path, replace):
+    periods = frame.index.strftime('%Y%m')
+    rows = [
+        key + (period, None if pd.isna(figure) else float(figure), None if pd.isna(yoy) else float(yoy))
+        for period, figure, yoy in zip(periods, frame['figure'].to_numpy(), frame['yoy'].to_numpy())
+    ]
+    with open_store(path) as conn:
+        if replace:
+            conn.execute(
+                "DELETE FROM series_data WHERE table_id = ? AND outlet_type = ? AND sv_code = ?", key
+            )
+        conn.executemany("INSERT OR REPLACE INTO series_data VALUES (?, ?, ?, ?, ?, ?)", rows)
+        latest_period = conn.execute(
+            "SELECT MAX(period) FROM series_data "
+            "WHERE table_id = ? AND outlet_type = ? AND sv_code = ?", key
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO series_meta VALUES (?, ?, ?, ?, ?)",
+            key + (fetched_at, latest_period)
+        )
+
+# Define a function to check whether stored metadata is due for a refresh
+def is_stale(meta, max_age=MAX_AGE):
+    return time.time() - meta['fetched_at'] > max_age
+
+# Define a function to run a refresh in a background thread
+# Only one refresh per key runs at a time; later requests are dropped
+def refresh_in_background(key, refresh):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+
+    def run():
+        try:
+            refresh()
+        except Exception:
+            # The stored copy keeps being served; the next stale read retries
+            logger.warning("Background refresh failed for %s", key, exc_info=True)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+# Define a function to try to take the refresh leases on several series
+# A lease is taken if nobody holds it or the previous one has expired. All are
+# tried in one write transaction, so of several processes asking for the same
+# series at once one gets every free lease rather than a share of them.
+# Returns {key: token to release it with} for the leases taken
+def acquire_leases(keys, seconds=LEASE_SECONDS, path=None):
+    tokens = {key: uuid.uuid4().hex for key in keys}
+    now = time.time()
+    try:
+        with open_store(path) as conn:
+            acquired = [
+                key for key, token in tokens.items()
+                if conn.execute(
+                    "INSERT INTO series_lease VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (table_id, outlet_type, sv_code) DO UPDATE "
+                    "SET holder = excluded.holder, expires_at = excluded.expires_at "
+                    "WHERE series_lease.expires_at < ?",
+                    key + (token, now + seconds, now)
+                ).rowcount
+            ]
+    except (sqlite3.Error, OSError):
+        # Without a usable store there is nothing to coordinate on, so refresh anyway
+        logger.warning("Could not take the leases on %s", list(tokens), exc_info=True)
+        return tokens
+    return {key: tokens[key] for key in acquired}
+
+# Define a function to give up leases taken with acquire_leases
+def release_leases(tokens, path=None):
+    try:
+        with open_store(path) as conn:
+            conn.executemany(
+                "DELETE FROM series_lease "
+                "WHERE table_id = ? AND outlet_type = ? AND sv_code = ? AND holder = ?",
+                [key + (token,) for key, token in tokens.items()]
+            )
+    except (sqlite3.Error, OSError):
+        logger.warning("Could not release the leases on %s", list(tokens), exc_info=True)
+
+# Define a context manager holding the leases on several series for a block
+# Yields the keys whose lease was taken; the others are being refreshed elsewhere
+@contextmanager
+def leases(keys, seconds=LEASE_SECONDS, path=None):
+    tokens = acquire_leases(keys, seconds, path)
+    try:
+        yield list(tokens)
+    finally:
+        if tokens:
+            release_leases(tokens, path)
+
+# Define a function to wait until nobody holds a lease on any of the keys
+# Returns False if some lease was still held when the timeout ran out
+def wait_for_leases(keys, timeout=LEASE_SECONDS, path=None):
+    keys = list(keys)
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            with open_store(path) as conn:
+                held = [
+                    key for key in keys
+                    if conn.execute(
+                        "SELECT 1 FROM series_lease WHERE table_id = ? AND outlet_type = ? "
+                        "AND sv_code = ? AND expires_at >= ?", key + (time.time(),)
+                    ).fetchone()
+                ]
+        except (sqlite3.Error, OSError):
+            logger.warning("Could not check the leases on %s", keys, exc_info=True)
+            return False
+        if not held:
+            return True
+        if time.monotonic() >= end:
+            return False
+        keys = held
+        time.sleep(LEASE_POLL)
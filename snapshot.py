@@ -0,0 +1,195 @@
+# Compact columnar snapshots of the series panel
+# A snapshot is a float32 matrix with one column per (measure, series), a
+# vector of YYYYMM periods and JSON metadata. It is written as a bundle of .npy
+# files, which np.load maps into memory without copying, and as one Arrow IPC
+# file, which pyarrow maps the same way. Each snapshot is named after the
+# upstream release it holds (its latest period with data), and latest.json
+# names the newest one, so consumers can skip releases and data versions they
+# already have. pyarrow is only imported for the Arrow file
+#
+# Usage from a notebook:
+#   import snapshot
+#   values, periods, meta = snapshot.load("build/snapshots")     # memory-mapped
+#   table, meta = snapshot.load_arrow("build/snapshots")          # memory-mapped
+#   panel = snapshot.to_panel(values, periods, meta)               # pandas frame
+
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import api_periods
+
+FORMAT_VERSION = 1  # Bump when the layout changes
+DTYPE = 'float32'
+FORMATS = ('npy', 'arrow')
+ARROW_FILE = 'snapshot.arrow'
+ARROW_MIME = 'application/vnd.apache.arrow.file'
+LATEST_FILE = 'latest.json'
+META_KEY = b'hk_retail_snapshot'  # Arrow schema metadata holding the JSON metadata
+
+# Define a function to return the latest period with any figure, as YYYYMM
+def release_of(panel):
+    valid = panel.notna().to_numpy().any(axis=1)
+    if not valid.any():
+        return None
+    return panel.index[np.flatnonzero(valid)[-1]].strftime('%Y%m')
+
+# Define a function to build a snapshot from a panel with (measure, series) columns
+# Returns (values, periods, meta); values are column-major so every column is
+# one contiguous block, which is what makes the Arrow columns zero-copy
+def build(panel, data_version, descriptions=None, **info):
+    descriptions = descriptions or {}
+    values = np.asfortranarray(panel.to_numpy(dtype=DTYPE))
+    periods = (panel.index.year * 100 + panel.index.month).to_numpy(dtype=np.int32)
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'release': release_of(panel),
+        'data_version': data_version,
+        'dtype': DTYPE,
+        'shape': list(values.shape),
+        'columns': [
+            {'measure': measure, 'series': series, 'description': descriptions.get(series)}
+            for measure, series in panel.columns
+        ],
+        'created_at': time.time(),
+        **info
+    }
+    return values, periods, meta
+
+# Define a function to name a snapshot column like the flat panel files do
+def column_name(column):
+    return f"{column['series']}_{column['measure']}"
+
+# Define a function to turn a snapshot into an Arrow table with its metadata
+# A period column comes first, then one float32 column per (measure, series)
+def to_arrow(values, periods, meta):
+    import pyarrow as pa
+
+    arrays = [pa.array(periods)] + [pa.array(values[:, i]) for i in range(values.shape[1])]
+    names = ['period'] + [column_name(column) for column in meta['columns']]
+    table = pa.Table.from_arrays(arrays, names=names)
+    return table.replace_schema_metadata({META_KEY: json.dumps(meta)})
+
+# Define a function to write a snapshot as an uncompressed Arrow IPC file, so it can be memory-mapped
+def write_arrow(values, periods, meta, path):
+    import pyarrow as pa
+
+    table = to_arrow(values, periods, meta)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+# Define a function to return a snapshot as Arrow IPC file bytes, e.g. for a download
+def arrow_bytes(values, periods, meta):
+    import pyarrow as pa
+
+    table = to_arrow(values, periods, meta)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+# Define a function to read the metadata of the snapshot in a directory, or None
+def read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Define a function to resolve a snapshot root to the directory of its latest
+# snapshot; a snapshot directory is returned as it is
+def resolve(path):
+    latest = os.path.join(path, LATEST_FILE)
+    if not os.path.exists(latest):
+        return path
+    with open(latest) as f:
+        return os.path.join(path, json.load(f)['release'])
+
+# Define a function to write a snapshot under root/<release>/ and point latest.json at it
+# An unchanged snapshot (same release and data version) is left alone, so files
+# consumers have mapped stay as they are; returns (directory, written)
+def write(snapshot, root, formats=FORMATS):
+    values, periods, meta = snapshot
+    if meta['release'] is None:
+        raise ValueError("Cannot write a snapshot without any data")
+    target = os.path.join(root, meta['release'])
+    current = read_meta(target)
+    written = not (
+        current is not None
+        and current.get('format_version') == FORMAT_VERSION
+        and current.get('data_version') == meta['data_version']
+        and set(current.get('formats', [])) >= set(formats)
+    )
+    if written:
+        # Build the new snapshot next to the old one and swap it in, so readers
+        # never see a half-written directory
+        os.makedirs(root, exist_ok=True)
+        staging = os.path.join(root, f".{meta['release']}-{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        meta = dict(meta, formats=list(formats))
+        if 'npy' in formats:
+            np.save(os.path.join(staging, 'values.npy'), values)
+            np.save(os.path.join(staging, 'periods.npy'), periods)
+        if 'arrow' in formats:
+            write_arrow(values, periods, meta, os.path.join(staging, ARROW_FILE))
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        if os.path.exists(target):
+            retired = f"{staging}-old"
+            os.rename(target, retired)
+            os.rename(staging, target)
+            shutil.rmtree(retired, ignore_errors=True)
+        else:
+            os.rename(staging, target)
+
+    # Only move latest.json forward, so writing an older release does not hide a newer one
+    latest_path = os.path.join(root, LATEST_FILE)
+    try:
+        with open(latest_path) as f:
+            latest = json.load(f)
+    except (OSError, ValueError):
+        latest = None
+    if latest is None or latest['release'] <= meta['release']:
+        staging = f"{latest_path}.{uuid.uuid4().hex}"
+        with open(staging, 'w') as f:
+            json.dump({'release': meta['release'], 'data_version': meta['data_version'],
+                       'format_version': FORMAT_VERSION}, f, indent=2)
+        os.replace(staging, latest_path)
+    return target, written
+
+# Define a function to load the .npy bundle of a snapshot without copying it
+# Takes a snapshot directory or a root with latest.json; the arrays are read-only
+# memory maps, so only the columns that are used are read from disk
+def load(path, mmap_mode='r'):
+    path = resolve(path)
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f"No snapshot in {path}")
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+    periods = np.load(os.path.join(path, 'periods.npy'), mmap_mode=mmap_mode)
+    return values, periods, meta
+
+# Define a function to load the Arrow file of a snapshot without copying it
+def load_arrow(path):
+    import pyarrow as pa
+
+    path = resolve(path)
+    if os.path.isdir(path):
+        path = os.path.join(path, ARROW_FILE)
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table, json.loads(table.schema.metadata[META_KEY])
+
+# Define a function to turn a snapshot back into a panel with (measure, series)
+# columns and a month-start period index
+def to_panel(values, periods, meta):
+    columns = pd.MultiIndex.from_tuples(
+        [(column['measure'], column['series']) for column in meta['columns']], names=[None, None]
+    )
+    index = api_periods.period_index(periods, 'M')
+    return pd.DataFrame(np.asarray(values), index=index, columns=columns)